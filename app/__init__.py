@@ -1,11 +1,11 @@
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, render_template
 import sys
 import os
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 from config import config
-from app.extensions import db, login_manager, bcrypt, migrate, csrf
+from app.extensions import db, login_manager, bcrypt, migrate, csrf, cache
 
 from app.auth import auth_bp
 from app.admin import admin_bp
@@ -13,6 +13,14 @@ from app.user import user_bp
 from app.product import product_bp
 from app.order import order_bp
 from app.utils.schema_migrate import ensure_sqlite_schema
+from app.utils.image_jobs import image_jobs
+from app.utils.view_counter import view_counter
+from app.utils.fulfillment import fulfillment
+from app.utils.scheduler import scheduler
+from app.utils.maintenance import register_jobs
+from app.utils.upload_serving import send_upload
+from app.utils.cdkey_import import raise_upload_limit
+from app.commands import register_commands
 
 def create_app(config_name='default'):
     app = Flask(__name__)
@@ -24,47 +32,58 @@ def create_app(config_name='default'):
     login_manager.init_app(app)
     bcrypt.init_app(app)
     migrate.init_app(app, db)
+    # 须在 CSRF 校验解析表单之前放宽卡密文件的上传限制
+    app.before_request(raise_upload_limit)
     csrf.init_app(app)
+    cache.init_app(app)
+    image_jobs.init_app(app)
+    view_counter.init_app(app)
+    fulfillment.init_app(app)
+    scheduler.init_app(app)
+    register_jobs(scheduler)
 
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(user_bp, url_prefix='/user')
     app.register_blueprint(product_bp, url_prefix='/product')
     app.register_blueprint(order_bp, url_prefix='/order')
+
+    register_commands(app)
     
     @app.route('/')
     def index():
         from app.models import Product
+        from app.utils.storefront_cache import cached_fragment
         
-        # 查询热门商品（按销量排序，最多4个）
-        hot_products = Product.query.filter_by(is_active=True).order_by(Product.sold_count.desc()).limit(4).all()
+        # 热门商品（按销量排序，最多4个）
+        hot_section = cached_fragment('index:hot', lambda: render_template(
+            'product/_product_section.html',
+            title='热门商品',
+            products=Product.query.filter_by(is_active=True).order_by(Product.sold_count.desc()).limit(4).all()
+        ))
         
-        # 查询最新商品（按创建时间排序，最多4个）
-        new_products = Product.query.filter_by(is_active=True).order_by(Product.created_at.desc()).limit(4).all()
+        # 最新商品（按创建时间排序，最多4个）
+        new_section = cached_fragment('index:new', lambda: render_template(
+            'product/_product_section.html',
+            title='最新上架',
+            products=Product.query.filter_by(is_active=True).order_by(Product.created_at.desc()).limit(4).all()
+        ))
         
         return render_template('index.html', 
-                             hot_products=hot_products, 
-                             new_products=new_products)
+                             hot_section=hot_section, 
+                             new_section=new_section)
     
     @app.route('/uploads/<path:filename>')
     def uploaded_file(filename):
-        upload_folder = app.config['UPLOAD_FOLDER']
-        return send_from_directory(upload_folder, filename)
+        return send_upload(filename)
 
     with app.app_context():
         ensure_sqlite_schema(db)
 
     @app.context_processor
     def inject_site_settings():
-        from app.models import SiteSetting
-        settings = SiteSetting.get()
-        quick_links = []
-        if settings.quick_links:
-            try:
-                import json
-                quick_links = json.loads(settings.quick_links)
-            except Exception:
-                quick_links = []
+        from app.utils.site_settings import get_site_settings
+        settings, quick_links = get_site_settings()
         return {'site_settings': settings, 'quick_links': quick_links}
     
     return app
@@ -1,24 +1,38 @@
 from flask import render_template, url_for, flash, redirect, request, current_app, jsonify
 from flask_login import login_required, current_user
 from app.admin import admin_bp
-from app.models import User, Product, Order_Core, OrderItem, Cart, DiscountCode, InviteRelation, EarningRecord, WithdrawalRequest, CDKey, SiteSetting
+from app.models import User, Product, Order_Core, OrderItem, Cart, DiscountCode, InviteRelation, EarningRecord, WithdrawalRequest, CDKey, SiteSetting, ProductTag, CDKeyImport
 from app.utils.crypto import encrypt_text
 from app.extensions import db, bcrypt
 from app.utils.image_processor import ImageProcessor
+from app.utils.image_jobs import image_jobs
 from app.utils.order_state_manager import OrderStateManager
 from app.utils.aff_calculator import AffiliateCalculator
-from app.utils.pagination import paginate
+from app.utils.pagination import paginate, keyset_paginate
+from app.utils.inventory import claim_cdkeys
+from app.utils.fulfillment import claim_order_for_shipping, fulfillment
+from app.utils.search_index import apply_search
+from app.utils.cdkey_import import import_cdkeys, start_import
+from app.utils.site_settings import invalidate_site_settings
+from app.utils.storefront_cache import invalidate_storefront
+from app.utils.product_tags import sync_product_tags
+from app.utils.dashboard_stats import get_dashboard_stats, invalidate_dashboard_stats
+from app.utils.order_rollup import change_order_status, record_user_created, get_sales_report
 from config import Config
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
 import secrets
-from sqlalchemy import extract
 
 def generate_invite_code():
     return secrets.token_urlsafe(10)[:10]
 
-order_state_manager = OrderStateManager(Config.ORDER_STATE_DATA_DIR)
+order_state_manager = OrderStateManager(
+    Config.ORDER_STATE_DATA_DIR,
+    Config.ORDER_STATE_BACKEND,
+    cache_size=Config.ORDER_STATE_CACHE_SIZE,
+    fsync=Config.ORDER_STATE_FSYNC
+)
 affiliate_calculator = AffiliateCalculator(Config.AFF_COMMISSION_RATE)
 
 def admin_required(f):
@@ -34,50 +48,33 @@ def admin_required(f):
 @login_required
 @admin_required
 def dashboard():
+    stats = get_dashboard_stats(current_app.config['DASHBOARD_STATS_TTL'])
+    return render_template('admin/dashboard.html', **stats)
+
+@admin_bp.route('/reports/sales')
+@login_required
+@admin_required
+def sales_report():
+    """按日期区间返回每日订单/成交额/新增用户（读取日汇总表）"""
     today = datetime.utcnow().date()
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else today
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'success': False, 'message': '日期格式应为YYYY-MM-DD'}), 400
+
+    if start > end or (end - start).days > 366:
+        return jsonify({'success': False, 'message': '日期区间无效（最长366天）'}), 400
 
-    today_orders = Order_Core.query.filter(
-        db.func.date(Order_Core.created_at) == today
-    ).count()
-
-    today_sales = db.session.query(
-        db.func.sum(Order_Core.final_amount)
-    ).filter(
-        db.func.date(Order_Core.created_at) == today,
-        Order_Core.cached_status.in_(['user_paid', 'shipped', 'completed'])
-    ).scalar() or 0
-
-    today_users = User.query.filter(
-        db.func.date(User.created_at) == today
-    ).count()
-
-    total_users = User.query.count()
-
-    total_products = Product.query.count()
-    total_orders = Order_Core.query.count()
-    pending_orders = Order_Core.query.filter(Order_Core.cached_status.in_(['pending_payment', 'user_paid', 'shipped'])).count()
-
-    # 查询月度销售统计数据
-    monthly_sales = []
-    for month in range(1, 7):
-        month_sales = db.session.query(
-            db.func.sum(Order_Core.final_amount)
-        ).filter(
-            extract('month', Order_Core.created_at) == month,
-            extract('year', Order_Core.created_at) == datetime.utcnow().year,
-            Order_Core.cached_status.in_(['user_paid', 'shipped', 'completed'])
-        ).scalar() or 0
-        monthly_sales.append(float(month_sales))
-
-    return render_template('admin/dashboard.html',
-                           today_orders=today_orders,
-                           today_sales=today_sales,
-                           today_users=today_users,
-                           total_users=total_users,
-                           total_products=total_products,
-                           total_orders=total_orders,
-                           monthly_sales=monthly_sales,
-                           pending_orders=pending_orders)
+    days = get_sales_report(start, end)
+    return jsonify({
+        'success': True,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'total_orders': sum(day['orders'] for day in days),
+        'total_sales': sum(day['sales'] for day in days),
+        'days': days
+    })
 
 @admin_bp.route('/users')
 @login_required
@@ -90,11 +87,7 @@ def user_management():
     query = User.query
 
     if search:
-        query = query.filter(
-            (User.username.ilike(f'%{search}%')) |
-            (User.email.ilike(f'%{search}%')) |
-            (User.display_name.ilike(f'%{search}%'))
-        )
+        query, _ = apply_search(query, User, search)
 
     if role:
         query = query.filter_by(role=role)
@@ -167,10 +160,7 @@ def product_management():
     query = Product.query
 
     if search:
-        query = query.filter(
-            (Product.name.ilike(f'%{search}%')) |
-            (Product.description.ilike(f'%{search}%'))
-        )
+        query, _ = apply_search(query, Product, search)
 
     query = query.order_by(Product.created_at.desc())
     pagination = paginate(query, page=page, per_page=20)
@@ -205,7 +195,7 @@ def add_product():
         image_filename = None
         if image:
             image_processor = ImageProcessor(current_app.config['UPLOAD_FOLDER'])
-            image_filename = image_processor.process_uploaded_image(image, 'products')
+            image_filename = image_processor.save_original(image, 'products')
 
         product = Product(
             name=name,
@@ -218,7 +208,13 @@ def add_product():
         )
 
         db.session.add(product)
+        db.session.flush()
+        sync_product_tags(product)
         db.session.commit()
+        invalidate_storefront()
+
+        if image_filename:
+            image_jobs.enqueue(image_filename, 'product', product.id, 'image_filename')
 
         flash('商品添加成功', 'success')
         return redirect(url_for('admin.product_management'))
@@ -243,16 +239,23 @@ def edit_product(product_id):
         product.tags = request.form.get('tags', product.tags)
 
         image = request.files.get('image')
+        image_filename = None
+        old_image = None
         if image:
             image_processor = ImageProcessor(current_app.config['UPLOAD_FOLDER'])
-            if product.image_filename:
-                image_processor.delete_image(product.image_filename)
-            image_filename = image_processor.process_uploaded_image(image, 'products')
+            old_image = product.image_filename
+            image_filename = image_processor.save_original(image, 'products')
             product.image_filename = image_filename
 
         product.is_active = 'is_active' in request.form
+        sync_product_tags(product)
 
         db.session.commit()
+        invalidate_storefront()
+        if old_image and old_image != image_filename:
+            image_processor.release_image(old_image)
+        if image_filename:
+            image_jobs.enqueue(image_filename, 'product', product.id, 'image_filename')
         flash('商品已更新', 'success')
         return redirect(url_for('admin.product_management'))
 
@@ -269,21 +272,26 @@ def delete_product(product_id):
     if has_orders:
         product.is_active = False
         db.session.commit()
+        invalidate_storefront()
         flash('该商品已有订单记录，已下架但无法删除', 'warning')
         if request.is_json:
             return jsonify({'success': True, 'message': '该商品已有订单记录，已下架但无法删除'})
         return redirect(url_for('admin.product_management'))
 
-    if product.image_filename:
-        image_processor = ImageProcessor(current_app.config['UPLOAD_FOLDER'])
-        image_processor.delete_image(product.image_filename)
+    image_filename = product.image_filename
 
     # 清理相关购物车与卡密
     Cart.query.filter_by(product_id=product_id).delete()
     CDKey.query.filter_by(product_id=product_id).delete()
+    ProductTag.query.filter_by(product_id=product_id).delete()
 
     db.session.delete(product)
     db.session.commit()
+    invalidate_storefront()
+
+    if image_filename:
+        image_processor = ImageProcessor(current_app.config['UPLOAD_FOLDER'])
+        image_processor.release_image(image_filename)
 
     flash('商品已删除', 'success')
     if request.is_json:
@@ -296,11 +304,11 @@ def delete_product(product_id):
 def product_cdkeys(product_id):
     product = Product.query.get_or_404(product_id)
 
-    page = request.args.get('page', 1, type=int)
-    query = CDKey.query.filter_by(product_id=product_id).order_by(CDKey.id.desc())
-    pagination = paginate(query, page=page, per_page=50)
+    query = CDKey.query.filter_by(product_id=product_id)
+    pagination = keyset_paginate(query, [CDKey.id], per_page=50)
+    imports = CDKeyImport.query.filter_by(product_id=product_id).order_by(CDKeyImport.created_at.desc()).limit(5).all()
 
-    return render_template('admin/product_cdkeys.html', product=product, pagination=pagination)
+    return render_template('admin/product_cdkeys.html', product=product, pagination=pagination, imports=imports)
 
 @admin_bp.route('/products/<int:product_id>/cdkeys/add', methods=['POST'])
 @login_required
@@ -313,29 +321,51 @@ def add_cdkeys(product_id):
         flash('请输入卡密', 'danger')
         return redirect(url_for('admin.product_cdkeys', product_id=product_id))
 
-    keys = [key.strip() for key in keys_text.split('\n') if key.strip()]
-    
-    added_count = 0
-    
-    for key in keys:
-        cdkey = CDKey(
-            product_id=product_id,
-            key=key,
-            status='unsold'
-        )
-        db.session.add(cdkey)
-        added_count += 1
-
-    product.stock_virtual = CDKey.query.filter_by(product_id=product_id, status='unsold').count()
-    db.session.commit()
+    keys = (key.strip() for key in keys_text.splitlines() if key.strip())
+    added_count, duplicate_count = import_cdkeys(product_id, keys)
 
     if added_count > 0:
-        flash(f'已成功添加{added_count}个卡密', 'success')
-    if added_count == 0:
+        message = f'已成功添加{added_count}个卡密'
+        if duplicate_count:
+            message += f'，跳过{duplicate_count}个重复卡密'
+        flash(message, 'success')
+    elif duplicate_count:
+        flash(f'没有新卡密被添加，{duplicate_count}个卡密已存在', 'warning')
+    else:
         flash('没有有效的卡密被添加', 'warning')
     
     return redirect(url_for('admin.product_cdkeys', product_id=product_id))
 
+@admin_bp.route('/products/<int:product_id>/cdkeys/import', methods=['POST'])
+@login_required
+@admin_required
+def import_cdkeys_file(product_id):
+    # 上传大小限制由 raise_upload_limit 在 CSRF 校验前放宽
+    product = Product.query.get_or_404(product_id)
+    file = request.files.get('keys_file')
+
+    if not file or not file.filename:
+        flash('请选择卡密文件', 'danger')
+        return redirect(url_for('admin.product_cdkeys', product_id=product.id))
+
+    job = start_import(product.id, file)
+    flash(f'卡密文件已上传，正在后台导入（任务 #{job.id}）', 'info')
+    return redirect(url_for('admin.product_cdkeys', product_id=product.id))
+
+@admin_bp.route('/products/<int:product_id>/cdkeys/import/<int:import_id>')
+@login_required
+@admin_required
+def cdkey_import_status(product_id, import_id):
+    job = CDKeyImport.query.filter_by(id=import_id, product_id=product_id).first_or_404()
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'processed': job.processed,
+        'added': job.added,
+        'duplicates': job.duplicates,
+        'error': job.error
+    })
+
 @admin_bp.route('/users/add', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -373,7 +403,9 @@ def add_user():
         )
 
         db.session.add(user)
+        record_user_created(user)
         db.session.commit()
+        invalidate_dashboard_stats()
 
         flash('用户添加成功', 'success')
         return redirect(url_for('admin.user_management'))
@@ -384,7 +416,6 @@ def add_user():
 @login_required
 @admin_required
 def order_management():
-    page = request.args.get('page', 1, type=int)
     status = request.args.get('status')
     search = request.args.get('search')
 
@@ -399,8 +430,7 @@ def order_management():
             (User.email.ilike(f'%{search}%'))
         )
 
-    query = query.order_by(Order_Core.created_at.desc())
-    pagination = paginate(query, page=page, per_page=20)
+    pagination = keyset_paginate(query, [Order_Core.created_at, Order_Core.id], per_page=20, count=None)
 
     return render_template('admin/order_management.html', pagination=pagination, status=status, search=search)
 
@@ -413,69 +443,94 @@ def order_detail(order_id):
 
     return render_template('admin/order_detail.html', order=order, order_state=order_state)
 
+@admin_bp.route('/orders/state-cache')
+@login_required
+@admin_required
+def order_state_cache_stats():
+    """订单状态读缓存命中统计"""
+    from app.order.routes import order_state_manager as storefront_state_manager
+    return jsonify({
+        'admin': order_state_manager.cache_info(),
+        'order': storefront_state_manager.cache_info()
+    })
+
+@admin_bp.route('/orders/<int:order_id>/confirm_payment', methods=['POST'])
+@login_required
+@admin_required
+def confirm_payment(order_id):
+    """确认用户声明的付款已到账；与确认一起提交自动发货任务"""
+    Order_Core.query.get_or_404(order_id)
+
+    # 条件更新：只确认一次，订单已被发货、拒绝或超时关闭时放弃
+    confirmed = Order_Core.query.filter_by(id=order_id, cached_status='user_paid', payment_confirmed_at=None).update(
+        {Order_Core.payment_confirmed_at: datetime.utcnow()}, synchronize_session=False
+    )
+    if not confirmed:
+        db.session.rollback()
+        if request.is_json:
+            return jsonify({'success': False, 'message': '订单状态不允许确认收款'})
+        flash('订单状态不允许确认收款', 'danger')
+        return redirect(url_for('admin.order_detail', order_id=order_id))
+
+    fulfillment.enqueue(order_id)
+    db.session.commit()
+    order_state_manager.update_state(order_id, 'user_paid', '管理员已确认收款')
+    fulfillment.notify()
+
+    if request.is_json:
+        return jsonify({'success': True, 'message': '已确认收款'})
+    flash('已确认收款', 'success')
+    return redirect(url_for('admin.order_detail', order_id=order_id))
+
 @admin_bp.route('/orders/<int:order_id>/ship', methods=['POST'])
 @login_required
 @admin_required
 def ship_order(order_id):
     order = Order_Core.query.get_or_404(order_id)
 
-    if order.cached_status != 'user_paid':
+    if not claim_order_for_shipping(order):
+        if request.is_json:
+            return jsonify({'success': False, 'message': '订单状态不允许发货'})
         flash('订单状态不允许发货', 'danger')
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
-    # 检查是否需要手动发货
-    has_cdkey = False
-    for order_item in order.order_items:
-        available = CDKey.query.filter_by(
-            product_id=order_item.product_id,
-            status='unsold'
-        ).limit(order_item.quantity).all()
-        if len(available) >= order_item.quantity:
-            has_cdkey = True
-            break
+    # 在同一事务中为所有订单行领取卡密；至少有一个商品的卡密足量时自动发货
+    lines = [(order_item.product_id, order_item.quantity) for order_item in order.order_items]
+    claimed = claim_cdkeys(order_id, lines)
+    has_cdkey = any(len(claimed.get(product_id, [])) >= quantity for product_id, quantity in lines)
 
     # 如果有卡密，自动发货
     if has_cdkey:
-        assigned_keys = []
-        for order_item in order.order_items:
-            cdkeys = CDKey.query.filter_by(
-                product_id=order_item.product_id,
-                status='unsold'
-            ).limit(order_item.quantity).all()
-
-            for cdkey in cdkeys:
-                cdkey.status = 'sold'
-                cdkey.sold_at = datetime.utcnow()
-                cdkey.order_id = order_id
-                assigned_keys.append(cdkey.key)
-
-            product = Product.query.get(order_item.product_id)
-            if product:
-                product.stock_virtual = CDKey.query.filter_by(product_id=order_item.product_id, status='unsold').count()
-
-        if assigned_keys:
-            order_state_manager.assign_cdkey(order_id, assigned_keys)
-
-        order_state_manager.update_state(order_id, 'shipped', '订单已发货')
-        order.cached_status = 'shipped'
+        assigned_keys = [key for keys in claimed.values() for key in keys]
+
+        with order_state_manager.batch():
+            if assigned_keys:
+                order_state_manager.assign_cdkey(order_id, assigned_keys)
+            order_state_manager.update_state(order_id, 'shipped', '订单已发货')
+        change_order_status(order, 'shipped')
         db.session.commit()
+        invalidate_dashboard_stats()
 
         if request.is_json:
             return jsonify({'success': True, 'message': '订单已发货'})
         flash('订单已发货', 'success')
         return redirect(url_for('admin.order_detail', order_id=order_id))
     else:
-        # 没有卡密，需要手动输入发货内容
+        # 没有卡密，释放本次领取并需要手动输入发货内容
+        db.session.rollback()
         if request.is_json:
             data = request.get_json()
             ship_content = data.get('ship_content', '')
             
             if not ship_content:
                 return jsonify({'success': False, 'message': '请输入发货内容'})
+            if not claim_order_for_shipping(order):
+                return jsonify({'success': False, 'message': '订单状态不允许发货'})
             
             order_state_manager.update_state(order_id, 'shipped', f'订单已发货：{ship_content}')
-            order.cached_status = 'shipped'
+            change_order_status(order, 'shipped')
             db.session.commit()
+            invalidate_dashboard_stats()
             
             return jsonify({'success': True, 'message': '订单已发货'})
         else:
@@ -493,9 +548,20 @@ def complete_order(order_id):
         flash('订单状态不允许完成', 'danger')
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
+    # 条件更新：与用户确认收货同时到达时只有一方生效，返佣只记一次
+    completed = Order_Core.query.filter_by(id=order.id, cached_status='shipped').update(
+        {Order_Core.cached_status: 'completed'}, synchronize_session=False
+    )
+    if not completed:
+        db.session.rollback()
+        flash('订单状态已变化，请刷新后重试', 'danger')
+        return redirect(url_for('admin.order_detail', order_id=order_id))
+
+    # cached_status 仍为旧值，由 change_order_status 写入并同步日汇总
     order_state_manager.update_state(order_id, 'completed', '订单已完成')
-    order.cached_status = 'completed'
+    change_order_status(order, 'completed')
     db.session.commit()
+    invalidate_dashboard_stats()
 
     invite_relation = InviteRelation.query.filter_by(invitee_id=order.user_id).first()
     if invite_relation:
@@ -515,9 +581,20 @@ def reject_order(order_id):
         flash('已完成的订单不能拒绝', 'danger')
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
+    # 条件更新：读取状态后订单被确认收货、发货或超时关闭时放弃本次操作
+    rejected = Order_Core.query.filter_by(id=order.id, cached_status=order.cached_status).update(
+        {Order_Core.cached_status: 'rejected'}, synchronize_session=False
+    )
+    if not rejected:
+        db.session.rollback()
+        flash('订单状态已变化，请刷新后重试', 'danger')
+        return redirect(url_for('admin.order_detail', order_id=order_id))
+
+    # cached_status 仍为旧值，由 change_order_status 写入并同步日汇总
     order_state_manager.update_state(order_id, 'rejected', reason)
-    order.cached_status = 'rejected'
+    change_order_status(order, 'rejected')
     db.session.commit()
+    invalidate_dashboard_stats()
 
     flash('订单已拒绝', 'success')
     return redirect(url_for('admin.order_detail', order_id=order_id))
@@ -692,8 +769,11 @@ def affiliate_management():
 @login_required
 @admin_required
 def settle_earnings():
-    count = affiliate_calculator.settle_earnings(current_app.config['SETTLEMENT_PERIOD'])
-    flash(f'已结算{count}笔收益', 'success')
+    result = affiliate_calculator.settle_earnings(current_app.config['SETTLEMENT_PERIOD'])
+    if result is None:
+        flash('结算正在进行中（可能是定时任务），请稍后查看结果', 'warning')
+        return redirect(url_for('admin.affiliate_management'))
+    flash(f"已结算{result['records']}笔收益，涉及{result['users']}个用户，共¥{result['amount']:.2f}", 'success')
     return redirect(url_for('admin.affiliate_management'))
 
 @admin_bp.route('/withdrawal/<int:withdrawal_id>/approve', methods=['POST'])
@@ -825,37 +905,49 @@ def update_settings():
         settings.quick_links = json.dumps(links, ensure_ascii=False)
 
     image_processor = ImageProcessor(current_app.config['UPLOAD_FOLDER'])
+    pending_images = []
+    replaced_images = []
 
     if logo:
         if settings.site_logo:
-            image_processor.delete_image(settings.site_logo)
-        settings.site_logo = image_processor.process_uploaded_image(logo, 'site')
+            replaced_images.append(settings.site_logo)
+        settings.site_logo = image_processor.save_original(logo, 'site')
+        pending_images.append(('site_logo', settings.site_logo))
     elif logo_url:
         settings.site_logo = logo_url.strip()
 
     if wechat_qr:
         if settings.wechat_qr:
-            image_processor.delete_image(settings.wechat_qr)
-        settings.wechat_qr = image_processor.process_uploaded_image(wechat_qr, 'payments')
+            replaced_images.append(settings.wechat_qr)
+        settings.wechat_qr = image_processor.save_original(wechat_qr, 'payments')
+        pending_images.append(('wechat_qr', settings.wechat_qr))
     elif wechat_qr_url:
         settings.wechat_qr = wechat_qr_url.strip()
 
     if alipay_qr:
         if settings.alipay_qr:
-            image_processor.delete_image(settings.alipay_qr)
-        settings.alipay_qr = image_processor.process_uploaded_image(alipay_qr, 'payments')
+            replaced_images.append(settings.alipay_qr)
+        settings.alipay_qr = image_processor.save_original(alipay_qr, 'payments')
+        pending_images.append(('alipay_qr', settings.alipay_qr))
     elif alipay_qr_url:
         settings.alipay_qr = alipay_qr_url.strip()
 
     if bank_qr:
         if settings.bank_qr:
-            image_processor.delete_image(settings.bank_qr)
-        settings.bank_qr = image_processor.process_uploaded_image(bank_qr, 'payments')
+            replaced_images.append(settings.bank_qr)
+        settings.bank_qr = image_processor.save_original(bank_qr, 'payments')
+        pending_images.append(('bank_qr', settings.bank_qr))
     elif bank_qr_url:
         settings.bank_qr = bank_qr_url.strip()
 
     settings.updated_at = datetime.utcnow()
     db.session.commit()
+    invalidate_site_settings()
+    for image_path in replaced_images:
+        image_processor.release_image(image_path)
+    for field, image_path in pending_images:
+        if image_path:
+            image_jobs.enqueue(image_path, 'site_setting', settings.id, field)
 
     flash('设置已更新', 'success')
     return redirect(url_for('admin.settings'))
@@ -881,6 +973,7 @@ def toggle_product_status():  # 这个函数名决定了端点名称
             return jsonify({'success': False, 'message': '无效的状态值'}), 400
 
         db.session.commit()
+        invalidate_storefront()
         
         return jsonify({'success': True, 'message': '商品状态更新成功'})
     except Exception as e:
@@ -942,11 +1035,12 @@ def export_products():
 def update_order_status():
     try:
         data = request.get_json()
-        order_id = data.get('order_id')
+        # 支持 order_ids 批量更新，所有状态变更合并为一次组提交
+        order_ids = list(dict.fromkeys(data.get('order_ids') or [data.get('order_id')]))
         status = data.get('status')
         reason = data.get('reason', '')
 
-        order = Order_Core.query.get_or_404(order_id)
+        orders = [Order_Core.query.get_or_404(order_id) for order_id in order_ids]
         
         # 验证状态转换是否合法
         valid_transitions = {
@@ -957,23 +1051,47 @@ def update_order_status():
             'rejected': ['pending_payment']  # 可以从拒绝状态恢复
         }
         
-        if order.cached_status not in valid_transitions or status not in valid_transitions[order.cached_status]:
-            return jsonify({'success': False, 'message': '不允许的状态转换'}), 400
+        for order in orders:
+            if order.cached_status not in valid_transitions or status not in valid_transitions[order.cached_status]:
+                return jsonify({'success': False, 'message': '不允许的状态转换'}), 400
+
+        # 条件更新：校验后订单被其他请求或定时任务（如超时关闭）改变时放弃本次操作
+        values = {Order_Core.cached_status: status}
+        if status == 'user_paid':
+            # 管理员直接标记已支付即确认收款
+            values[Order_Core.payment_confirmed_at] = datetime.utcnow()
+        elif status == 'pending_payment':
+            values[Order_Core.payment_confirmed_at] = None
+        for order in orders:
+            moved = Order_Core.query.filter_by(id=order.id, cached_status=order.cached_status).update(
+                values, synchronize_session=False
+            )
+            if not moved:
+                db.session.rollback()
+                return jsonify({'success': False, 'message': '订单状态已变化，请刷新后重试'}), 409
 
         # 执行状态变更
-        if status == 'rejected':
-            order_state_manager.update_state(order_id, 'rejected', reason or '订单被拒绝')
-        else:
-            order_state_manager.update_state(order_id, status, f'订单状态更新为 {status}')
-            
-        order.cached_status = status
+        with order_state_manager.batch():
+            for order in orders:
+                if status == 'rejected':
+                    order_state_manager.update_state(order.id, 'rejected', reason or '订单被拒绝')
+                else:
+                    order_state_manager.update_state(order.id, status, f'订单状态更新为 {status}')
+                change_order_status(order, status)
+                if status == 'user_paid':
+                    # 管理员确认收款，与状态一起提交自动发货任务
+                    fulfillment.enqueue(order.id)
         db.session.commit()
+        invalidate_dashboard_stats()
+        if status == 'user_paid':
+            fulfillment.notify()
 
         # 如果是完成订单，处理返佣
         if status == 'completed':
-            invite_relation = InviteRelation.query.filter_by(invitee_id=order.user_id).first()
-            if invite_relation:
-                affiliate_calculator.create_earning_record(invite_relation.inviter_id, order.id, order.final_amount)
+            for order in orders:
+                invite_relation = InviteRelation.query.filter_by(invitee_id=order.user_id).first()
+                if invite_relation:
+                    affiliate_calculator.create_earning_record(invite_relation.inviter_id, order.id, order.final_amount)
 
         return jsonify({'success': True, 'message': '订单状态更新成功'})
     except Exception as e:
@@ -3,6 +3,7 @@ from flask_login import login_user, logout_user, current_user
 from app.auth import auth_bp
 from app.models import User
 from app.extensions import db, bcrypt
+from app.utils.order_rollup import record_user_created
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -80,6 +81,7 @@ def register():
             
             db.session.add(user)
             db.session.flush()  # 获取用户ID，但暂不提交
+            record_user_created(user)
             
             # 如果有邀请码，则建立邀请关系
             if entered_invite_code:
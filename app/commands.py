@@ -0,0 +1,117 @@
+import click
+from flask import current_app
+
+
+def register_commands(app):
+    """注册命令行维护命令（flask <command>）"""
+
+    @app.cli.command('migrate-order-states')
+    def migrate_order_states():
+        """将旧版JSON订单状态导入事件日志"""
+        from app.utils.order_state_manager import OrderStateManager, EventLogBackend
+
+        data_dir = current_app.config['ORDER_STATE_DATA_DIR']
+        manager = OrderStateManager(data_dir, EventLogBackend(data_dir, fsync=current_app.config['ORDER_STATE_FSYNC']))
+        imported, skipped = manager.migrate_from_json()
+        click.echo(f'已导入{imported}个订单状态，跳过{skipped}个')
+
+    @app.cli.command('recount-cdkey-stock')
+    def recount_cdkey_stock_command():
+        """按卡密表重新校准商品的未售卡密计数"""
+        from app.utils.inventory import recount_cdkey_stock
+
+        updated = recount_cdkey_stock()
+        click.echo(f'已校准{updated}个商品的卡密库存')
+
+    @app.cli.command('import-cdkeys')
+    @click.argument('product_id', type=int)
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    def import_cdkeys_command(product_id, path):
+        """从文本文件流式导入卡密（每行一个，已存在的自动跳过）"""
+        from app.utils.cdkey_import import import_cdkeys, iter_key_lines
+
+        def report(processed, added, duplicates):
+            click.echo(f'已处理{processed}行，新增{added}，重复{duplicates}')
+
+        with open(path, 'rb') as f:
+            added, duplicates = import_cdkeys(product_id, iter_key_lines(f), on_progress=report)
+        click.echo(f'导入完成：新增{added}个卡密，跳过{duplicates}个重复')
+
+    @app.cli.command('rebuild-order-rollup')
+    def rebuild_order_rollup_command():
+        """根据历史订单重建 order_daily_rollup 日汇总表"""
+        from app.utils.order_rollup import rebuild_order_rollup
+
+        rows = rebuild_order_rollup()
+        click.echo(f'日汇总表已重建，共{rows}行')
+
+    @app.cli.command('rebuild-product-tags')
+    def rebuild_product_tags_command():
+        """根据商品的 tags 字段重建 product_tag 标签关联表"""
+        from app.utils.product_tags import rebuild_product_tags
+
+        rows = rebuild_product_tags()
+        click.echo(f'标签关联表已重建，共{rows}行')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """重建商品与用户的 FTS5 全文索引"""
+        from app.utils.search_index import SEARCH_INDEXES, rebuild_search_index, search_ready
+
+        for table_name in SEARCH_INDEXES:
+            if not search_ready(table_name):
+                click.echo(f'{table_name} 不可用（非SQLite或不支持FTS5），搜索使用LIKE')
+                continue
+            rows = rebuild_search_index(table_name)
+            click.echo(f'{table_name} 已重建，共{rows}行')
+
+    @app.cli.command('run-job')
+    @click.argument('name')
+    def run_job_command(name):
+        """立即执行一次定时任务（与调度线程共用租约，不会重复执行）"""
+        from app.utils.scheduler import scheduler
+
+        if name not in scheduler.jobs:
+            click.echo(f'未知任务: {name}，可用任务: {", ".join(scheduler.jobs)}')
+            raise SystemExit(1)
+        result = scheduler.run_job(name)
+        if result is None:
+            click.echo(f'{name} 正在其他进程中执行')
+            return
+        click.echo(f"{name}: {result['status']}，{result['rows']}行，耗时{result['duration']:.2f}秒")
+        if result['error']:
+            click.echo(result['error'])
+
+    @app.cli.command('scheduled-jobs')
+    def scheduled_jobs_command():
+        """列出定时任务的执行计划与最近一次执行情况"""
+        from app.models import ScheduledJob
+        from app.utils.scheduler import scheduler
+
+        scheduler.sync_jobs()
+        for job in ScheduledJob.query.order_by(ScheduledJob.name).all():
+            last = '-'
+            if job.last_finished_at:
+                last = f"{job.last_finished_at:%Y-%m-%d %H:%M:%S} {job.last_status} {job.last_rows}行 {job.last_duration:.2f}秒"
+            running = f' 执行中({job.lease_owner})' if job.lease_owner else ''
+            click.echo(f'{job.name:<24} {job.schedule:<14} 下次 {job.next_run_at:%Y-%m-%d %H:%M:%S}  上次 {last}{running}')
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans():
+        """用 EXPLAIN QUERY PLAN 检查热点查询是否命中索引（仅SQLite）"""
+        from app.extensions import db
+        from app.utils.query_plans import HOT_QUERIES, explain_query
+
+        if db.engine.dialect.name != 'sqlite':
+            click.echo('仅支持SQLite')
+            return
+
+        failed = 0
+        for name, sql in HOT_QUERIES:
+            uses_index, plan = explain_query(db.session, sql)
+            if not uses_index:
+                failed += 1
+            click.echo(f"[{'OK' if uses_index else 'SCAN'}] {name}: {' | '.join(plan)}")
+
+        if failed:
+            raise SystemExit(1)
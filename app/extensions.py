@@ -3,6 +3,7 @@ from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
 from flask_wtf import CSRFProtect
+from flask_caching import Cache
 
 # 初始化扩展
 db = SQLAlchemy()
@@ -10,6 +11,7 @@ login_manager = LoginManager()
 bcrypt = Bcrypt()
 migrate = Migrate()
 csrf = CSRFProtect()
+cache = Cache()
 
 # 配置登录管理
 login_manager.login_view = 'auth.login'
@@ -5,6 +5,9 @@ import json
 
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
+    __table_args__ = (
+        db.Index('ix_user_created_at', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
     display_name = db.Column(db.String(50), nullable=False)
@@ -25,8 +28,17 @@ class User(UserMixin, db.Model):
     earnings = db.relationship('EarningRecord', backref='user', lazy=True)
     withdrawals = db.relationship('WithdrawalRequest', backref='user', lazy=True)
 
+    def avatar_variants(self, size='avatar'):
+        """返回头像的尺寸变体 {格式: URL}，变体尚未生成或为远程图片时为空"""
+        from app.utils.image_processor import variant_sources
+        return dict(variant_sources(self.avatar_filename, size))
+
 class Product(db.Model):
     __tablename__ = 'product'
+    __table_args__ = (
+        db.Index('ix_product_active_sold', 'is_active', 'sold_count'),
+        db.Index('ix_product_active_created', 'is_active', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     price = db.Column(db.Float, nullable=False)
@@ -38,6 +50,7 @@ class Product(db.Model):
     view_count = db.Column(db.Integer, default=0)
     sold_count = db.Column(db.Integer, default=0)
     stock_virtual = db.Column(db.Integer, default=0)
+    cdkey_stock = db.Column(db.Integer, nullable=False, default=0)  # 未售卡密数量（计数器）
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     order_items = db.relationship('OrderItem', back_populates='product', lazy=True)
@@ -54,8 +67,30 @@ class Product(db.Model):
             return f"/uploads/{self.image_filename}"
         return "https://via.placeholder.com/300x200"
 
+    def image_variants(self, size):
+        """返回指定尺寸（card/detail）的图片变体 {格式: URL}，变体尚未生成或为远程图片时为空"""
+        from app.utils.image_processor import variant_sources
+        return dict(variant_sources(self.image_filename, size))
+
+    def image_url_for(self, size):
+        """返回指定尺寸的 JPEG 变体URL，没有变体时回退到原图"""
+        return self.image_variants(size).get('jpg') or self.image_url
+
+class ProductTag(db.Model):
+    """商品-标签关联表，由 Product.tags 同步，用于按标签筛选和统计标签"""
+    __tablename__ = 'product_tag'
+    __table_args__ = (
+        db.Index('ix_product_tag_tag', 'tag', 'product_id'),
+    )
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    tag = db.Column(db.String(50), primary_key=True)
+
 class Cart(db.Model):
     __tablename__ = 'cart'
+    __table_args__ = (
+        # 以 user_id 开头，同时覆盖按用户查询购物车
+        db.Index('uq_cart_user_product', 'user_id', 'product_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
@@ -83,6 +118,11 @@ class DiscountCode(db.Model):
 
 class Order_Core(db.Model):
     __tablename__ = 'order_core'
+    __table_args__ = (
+        db.Index('ix_order_core_created_at', 'created_at'),
+        db.Index('ix_order_core_user_created', 'user_id', 'created_at'),
+        db.Index('ix_order_core_status_created', 'cached_status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     order_no = db.Column(db.String(6), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -90,6 +130,8 @@ class Order_Core(db.Model):
     original_amount = db.Column(db.Float, nullable=False)
     final_amount = db.Column(db.Float, nullable=False)
     cached_status = db.Column(db.String(20), default='pending_payment')
+    # 管理员确认收款的时间；用户自己声明已支付时为空，确认后才会自动发货
+    payment_confirmed_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     user = db.relationship('User', back_populates='orders', lazy=True)
@@ -107,8 +149,21 @@ class OrderItem(db.Model):
     order = db.relationship('Order_Core', back_populates='order_items', lazy=True)
     product = db.relationship('Product', back_populates='order_items', lazy=True)
 
+class OrderDailyRollup(db.Model):
+    """按 (下单日期, 订单状态) 预聚合的订单统计；status 为 '*' 的行汇总当天全部订单及新增用户"""
+    __tablename__ = 'order_daily_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    new_users = db.Column(db.Integer, nullable=False, default=0)
+
 class InviteRelation(db.Model):
     __tablename__ = 'invite_relation'
+    __table_args__ = (
+        db.Index('ix_invite_relation_inviter', 'inviter_id'),
+        db.Index('ix_invite_relation_invitee', 'invitee_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     inviter_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     invitee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -117,6 +172,10 @@ class InviteRelation(db.Model):
 
 class EarningRecord(db.Model):
     __tablename__ = 'earning_record'
+    __table_args__ = (
+        db.Index('ix_earning_record_status_created', 'status', 'created_at'),
+        db.Index('ix_earning_record_user_created', 'user_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     source = db.Column(db.String(50), nullable=False)
@@ -126,6 +185,23 @@ class EarningRecord(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     settled_at = db.Column(db.DateTime, nullable=True)
 
+class SettlementRun(db.Model):
+    """收益结算批次：记录检查点与统计，中断后下一次结算从检查点继续"""
+    __tablename__ = 'settlement_run'
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running / done / failed
+    cutoff = db.Column(db.DateTime, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    records = db.Column(db.Integer, nullable=False, default=0)
+    users = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    chunks = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    lease_owner = db.Column(db.String(200), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
 class WithdrawalRequest(db.Model):
     __tablename__ = 'withdrawal_request'
     id = db.Column(db.Integer, primary_key=True)
@@ -137,13 +213,70 @@ class WithdrawalRequest(db.Model):
 
 class CDKey(db.Model):
     __tablename__ = 'cdkey'
+    __table_args__ = (
+        db.Index('ix_cdkey_product_status', 'product_id', 'status'),
+        # 同一商品下卡密去重；按定长哈希建唯一索引，比直接索引卡密原文更小
+        db.Index('ux_cdkey_product_key_hash', 'product_id', 'key_hash', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     key = db.Column(db.String(100), nullable=False)
+    key_hash = db.Column(db.String(32), nullable=True)
     status = db.Column(db.String(20), default='unsold')
     sold_at = db.Column(db.DateTime, nullable=True)
     order_id = db.Column(db.Integer, nullable=True)
 
+class CDKeyImport(db.Model):
+    """卡密文件导入任务，后台线程按块写入时更新进度"""
+    __tablename__ = 'cdkey_import'
+    __table_args__ = (
+        db.Index('ix_cdkey_import_product_created', 'product_id', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    filename = db.Column(db.String(200), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending / running / done / failed
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    added = db.Column(db.Integer, nullable=False, default=0)
+    duplicates = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)  # 心跳，每块提交后刷新
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class FulfillmentJob(db.Model):
+    """自动发货队列：订单支付时与订单状态一起写入，由后台线程领取卡密并发货"""
+    __tablename__ = 'fulfillment_job'
+    __table_args__ = (
+        db.Index('ix_fulfillment_job_status_run_after', 'status', 'run_after'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # 每个订单只入队一次，重复支付回调不会重复发货
+    order_id = db.Column(db.Integer, db.ForeignKey('order_core.id'), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending / running / done / manual / skipped / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ScheduledJob(db.Model):
+    """定时任务的执行计划、租约与最近一次执行统计"""
+    __tablename__ = 'scheduled_job'
+    name = db.Column(db.String(100), primary_key=True)
+    schedule = db.Column(db.String(100), nullable=True)
+    next_run_at = db.Column(db.DateTime, nullable=False)
+    # 执行中的进程持有租约，到期未释放视为该进程已崩溃
+    lease_owner = db.Column(db.String(200), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_duration = db.Column(db.Float, nullable=True)
+    last_rows = db.Column(db.Integer, nullable=True)
+    last_status = db.Column(db.String(20), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    run_count = db.Column(db.Integer, nullable=False, default=0)
+
 class SiteSetting(db.Model):
     __tablename__ = 'site_setting'
     id = db.Column(db.Integer, primary_key=True)
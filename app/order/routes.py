@@ -1,46 +1,64 @@
-from flask import render_template, url_for, flash, redirect, request, jsonify, session, current_app
+from flask import render_template, url_for, flash, redirect, request, jsonify, session, current_app, g
 from flask_login import current_user, login_required
 from app.order import order_bp
-from app.models import Cart, Product, Order_Core, OrderItem, DiscountCode, CDKey, InviteRelation
+from app.models import Cart, Product, Order_Core, OrderItem, DiscountCode, InviteRelation
 from app.extensions import db
 from app.utils.order_state_manager import OrderStateManager
 from app.utils.aff_calculator import AffiliateCalculator
+from app.utils import cart_service
+from app.utils.inventory import get_available_stock, get_available_stock_many
+from app.utils.storefront_cache import invalidate_storefront
+from app.utils.dashboard_stats import invalidate_dashboard_stats
+from app.utils.order_rollup import change_order_status, record_order_created
 from config import Config
 from datetime import datetime
 import random
 
-order_state_manager = OrderStateManager(Config.ORDER_STATE_DATA_DIR)
+order_state_manager = OrderStateManager(
+    Config.ORDER_STATE_DATA_DIR,
+    Config.ORDER_STATE_BACKEND,
+    cache_size=Config.ORDER_STATE_CACHE_SIZE,
+    fsync=Config.ORDER_STATE_FSYNC
+)
 affiliate_calculator = AffiliateCalculator(Config.AFF_COMMISSION_RATE)
 
 def generate_order_no():
     return f"{random.randint(0, 999999):06d}"
 
-def get_available_stock(product_id):
-    cdkey_count = CDKey.query.filter_by(product_id=product_id, status='unsold').count()
-    if cdkey_count > 0:
-        return cdkey_count
-    product = Product.query.get(product_id)
-    return product.stock_virtual if product else 0
+def load_user_cart(user_id):
+    """一次联表查询加载用户购物车（仅包含上架商品）"""
+    rows = db.session.query(
+        Cart.quantity,
+        Product.id,
+        Product.name,
+        Product.price,
+        Product.image_filename
+    ).join(
+        Product, Cart.product_id == Product.id
+    ).filter(
+        Cart.user_id == user_id,
+        Product.is_active == True
+    ).order_by(Cart.id).all()
+
+    return [{
+        'product_id': product_id,
+        'name': name,
+        'price': price,
+        'quantity': quantity,
+        'image': image_filename
+    } for quantity, product_id, name, price, image_filename in rows]
 
 def get_cart():
     if current_user.is_authenticated:
-        cart_items = Cart.query.filter_by(user_id=current_user.id).all()
-        cart = []
-        for item in cart_items:
-            product = Product.query.get(item.product_id)
-            if product and product.is_active:
-                cart.append({
-                    'product_id': product.id,
-                    'name': product.name,
-                    'price': product.price,
-                    'quantity': item.quantity,
-                    'image': product.image_filename
-                })
-        return cart
+        # 同一请求内只加载一次购物车
+        if 'cart' not in g:
+            g.cart = load_user_cart(current_user.id)
+        return g.cart
     else:
         return session.get('cart', [])
 
 def save_cart(cart):
+    """整体替换购物车（单个商品的增删改请用 cart_service）"""
     if current_user.is_authenticated:
         Cart.query.filter_by(user_id=current_user.id).delete()
         for item in cart:
@@ -51,6 +69,7 @@ def save_cart(cart):
             )
             db.session.add(cart_item)
         db.session.commit()
+        g.cart = cart
     else:
         session['cart'] = cart
 
@@ -88,7 +107,8 @@ def add_to_cart():
     if quantity < 1:
         return jsonify({'success': False, 'message': '数量不能小于1'})
     
-    if get_available_stock(product_id) < quantity:
+    available_stock = get_available_stock(product_id)
+    if available_stock < quantity:
         return jsonify({'success': False, 'message': '库存不足'})
     
     cart = get_cart()
@@ -97,7 +117,7 @@ def add_to_cart():
     
     if existing_item:
         new_quantity = existing_item['quantity'] + quantity
-        if get_available_stock(product_id) < new_quantity:
+        if available_stock < new_quantity:
             return jsonify({'success': False, 'message': '库存不足'})
         existing_item['quantity'] = new_quantity
     else:
@@ -109,7 +129,10 @@ def add_to_cart():
             'image': product.image_filename
         })
     
-    save_cart(cart)
+    if current_user.is_authenticated:
+        cart_service.add_item(current_user.id, product_id, quantity)
+    else:
+        save_cart(cart)
     
     cart_count = sum(item['quantity'] for item in cart)
     
@@ -148,7 +171,10 @@ def update_cart():
             item['quantity'] = quantity
             break
     
-    save_cart(cart)
+    if current_user.is_authenticated:
+        cart_service.set_quantity(current_user.id, product_id, quantity)
+    else:
+        save_cart(cart)
     
     total = sum(item['price'] * item['quantity'] for item in cart)
     cart_count = sum(item['quantity'] for item in cart)
@@ -170,10 +196,13 @@ def remove_from_cart():
     except (TypeError, ValueError):
         return jsonify({'success': False, 'message': '参数错误'})
     
-    cart = get_cart()
-    cart = [item for item in cart if item['product_id'] != product_id]
+    cart = [item for item in get_cart() if item['product_id'] != product_id]
     
-    save_cart(cart)
+    if current_user.is_authenticated:
+        cart_service.remove_item(current_user.id, product_id)
+        g.cart = cart
+    else:
+        save_cart(cart)
     
     total = sum(item['price'] * item['quantity'] for item in cart)
     cart_count = sum(item['quantity'] for item in cart)
@@ -187,7 +216,11 @@ def remove_from_cart():
 
 @order_bp.route('/cart/clear', methods=['POST'])
 def clear_cart():
-    save_cart([])
+    if current_user.is_authenticated:
+        cart_service.clear(current_user.id)
+        g.cart = []
+    else:
+        save_cart([])
     
     return jsonify({
         'success': True,
@@ -324,12 +357,17 @@ def create_order():
     final_amount = original_amount
     discount_code_id = None
     
+    # 一次查询取出购物车中的全部商品，后续不再逐个查询
+    product_ids = {item['product_id'] for item in cart}
+    products = {product.id: product for product in Product.query.filter(Product.id.in_(product_ids)).all()}
+
     # 校验库存与商品状态
+    available_stocks = get_available_stock_many(product_ids)
     for cart_item in cart:
-        product = Product.query.get(cart_item['product_id'])
+        product = products.get(cart_item['product_id'])
         if not product or not product.is_active:
             return jsonify({'success': False, 'message': '购物车中包含已下架商品'})
-        if get_available_stock(product.id) < cart_item['quantity']:
+        if available_stocks.get(product.id, 0) < cart_item['quantity']:
             return jsonify({'success': False, 'message': f'商品 {product.name} 库存不足'})
     
     if discount_code_str:
@@ -351,46 +389,80 @@ def create_order():
                 discount_amount = discount_code.value
             final_amount = max(0, original_amount - discount_amount)
             discount_code_id = discount_code.id
-            discount_code.used_count += 1
     
     order_no = generate_order_no()
     while Order_Core.query.filter_by(order_no=order_no).first():
         order_no = generate_order_no()
 
-    order = Order_Core(
-        user_id=current_user.id,
-        order_no=order_no,
-        discount_code_id=discount_code_id,
-        original_amount=original_amount,
-        final_amount=final_amount,
-        cached_status='pending_payment'
-    )
-    
-    db.session.add(order)
-    db.session.commit()
-    
-    items_data = []
-    for cart_item in cart:
-        product = Product.query.get(cart_item['product_id'])
-        if product:
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=product.id,
-                quantity=cart_item['quantity'],
-                price=product.price
-            )
-            db.session.add(order_item)
-            
+    # 以下写入在同一个事务中完成，任何一步失败都整体回滚
+    try:
+        if discount_code_id:
+            # 原子占用一次折扣码使用次数；并发下单时由 max_uses 条件保证不超发
+            claimed = DiscountCode.query.filter(
+                DiscountCode.id == discount_code_id,
+                db.or_(
+                    DiscountCode.max_uses.is_(None),
+                    DiscountCode.max_uses == 0,
+                    db.func.coalesce(DiscountCode.used_count, 0) < DiscountCode.max_uses
+                )
+            ).update({
+                DiscountCode.used_count: db.func.coalesce(DiscountCode.used_count, 0) + 1
+            }, synchronize_session=False)
+            if not claimed:
+                db.session.rollback()
+                return jsonify({'success': False, 'message': '折扣码使用次数已达上限'})
+
+        order = Order_Core(
+            user_id=current_user.id,
+            order_no=order_no,
+            discount_code_id=discount_code_id,
+            original_amount=original_amount,
+            final_amount=final_amount,
+            cached_status='pending_payment'
+        )
+        db.session.add(order)
+        db.session.flush()
+        record_order_created(order)
+
+        items_data = []
+        quantities = {}
+        for cart_item in cart:
+            product = products[cart_item['product_id']]
             items_data.append({
                 'product_id': product.id,
                 'name': product.name,
                 'quantity': cart_item['quantity'],
                 'price': product.price
             })
-            
-            product.sold_count += cart_item['quantity']
-    
-    db.session.commit()
+            quantities[product.id] = quantities.get(product.id, 0) + cart_item['quantity']
+
+        db.session.execute(db.insert(OrderItem.__table__), [
+            {
+                'order_id': order.id,
+                'product_id': item['product_id'],
+                'quantity': item['quantity'],
+                'price': item['price']
+            }
+            for item in items_data
+        ])
+
+        # 销量用 SQL 自增，避免并发下单时读改写互相覆盖
+        product_table = Product.__table__
+        db.session.execute(
+            db.update(product_table)
+            .where(product_table.c.id == db.bindparam('b_id'))
+            .values(sold_count=db.func.coalesce(product_table.c.sold_count, 0) + db.bindparam('b_quantity')),
+            [{'b_id': product_id, 'b_quantity': quantity} for product_id, quantity in quantities.items()]
+        )
+
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"创建订单时出错: {str(e)}")
+        return jsonify({'success': False, 'message': '创建订单失败，请稍后重试'})
+
+    invalidate_dashboard_stats()
+    invalidate_storefront()
     
     customer_info = {
         'name': name,
@@ -401,7 +473,7 @@ def create_order():
     }
     order_state_manager.create_initial_state(order.id, current_user.id, items_data, customer=customer_info, order_no=order.order_no)
     
-    save_cart([])
+    cart_service.clear(current_user.id)
     
     return jsonify({
         'success': True,
@@ -434,9 +506,20 @@ def pay_order(order_id):
     if order.cached_status != 'pending_payment':
         return jsonify({'success': False, 'message': '订单状态不允许支付'})
     
+    # 条件更新：与超时关闭订单的定时任务同时到达时只有一方生效
+    paid = Order_Core.query.filter_by(id=order.id, cached_status='pending_payment').update(
+        {Order_Core.cached_status: 'user_paid'}, synchronize_session=False
+    )
+    if not paid:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': '订单状态不允许支付'})
+
+    # 用户声明已支付只是待核实的状态，不触发自动发货；收款由管理员确认
+    # cached_status 仍为旧值，由 change_order_status 写入并同步日汇总
     order_state_manager.update_state(order_id, 'user_paid', '用户已支付')
-    order.cached_status = 'user_paid'
+    change_order_status(order, 'user_paid')
     db.session.commit()
+    invalidate_dashboard_stats()
     
     return jsonify({'success': True, 'message': '支付成功'})
 
@@ -451,9 +534,19 @@ def confirm_receipt(order_id):
     if order.cached_status != 'shipped':
         return jsonify({'success': False, 'message': '订单状态不允许确认收货'})
 
+    # 条件更新：与管理员完成或拒绝订单同时到达时只有一方生效，返佣只记一次
+    completed = Order_Core.query.filter_by(id=order.id, cached_status='shipped').update(
+        {Order_Core.cached_status: 'completed'}, synchronize_session=False
+    )
+    if not completed:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': '订单状态不允许确认收货'})
+
+    # cached_status 仍为旧值，由 change_order_status 写入并同步日汇总
     order_state_manager.update_state(order_id, 'completed', '用户确认收货')
-    order.cached_status = 'completed'
+    change_order_status(order, 'completed')
     db.session.commit()
+    invalidate_dashboard_stats()
 
     invite_relation = InviteRelation.query.filter_by(invitee_id=order.user_id).first()
     if invite_relation:
@@ -476,7 +569,7 @@ def acknowledge_rejected(order_id):
         return jsonify({'success': False, 'message': '订单状态不允许确认已知晓'})
 
     order_state_manager.update_state(order_id, 'rejected', '用户已知晓拒绝')
-    order.cached_status = 'rejected'
+    change_order_status(order, 'rejected')
     db.session.commit()
 
     return jsonify({'success': True, 'message': '已知晓'})
@@ -1,16 +1,27 @@
-from flask import render_template, url_for, flash, redirect, request, jsonify, current_app
+from flask import render_template, url_for, flash, redirect, request, jsonify, current_app, session
 from flask_login import login_required, current_user
 from app.product import product_bp
 from app.models import Product
 from app.extensions import db
 from app.utils.pagination import paginate
+from app.utils.product_tags import filter_by_tags, get_tag_counts
+from app.utils.search_index import apply_search
+from app.utils.view_counter import view_counter
+from app.utils.storefront_cache import cached_fragment, get_cached_page, set_cached_page
 
 @product_bp.route('/list')
 def product_list():
+    # 游客且没有待显示的提示消息时整页缓存，键包含查询参数
+    cacheable = not current_user.is_authenticated and not session.get('_flashes')
+    if cacheable:
+        html = get_cached_page('product_list')
+        if html is not None:
+            return html
+
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     tags = request.args.get('tags')
-    search_query = None
+    search_query = (request.args.get('q') or '').strip() or None
     sort_by = request.args.get('sort', 'default')
     page = request.args.get('page', 1, type=int)
 
@@ -23,11 +34,11 @@ def product_list():
         query = query.filter(Product.price <= max_price)
 
     if tags:
-        tag_list = tags.split(',')
-        for tag in tag_list:
-            query = query.filter(Product.tags.like(f'%{tag}%'))
+        query = filter_by_tags(query, tags)
 
-    # 搜索功能已移除
+    rank = None
+    if search_query:
+        query, rank = apply_search(query, Product, search_query)
 
     if sort_by == 'price_asc':
         query = query.order_by(Product.price.asc())
@@ -37,25 +48,26 @@ def product_list():
         query = query.order_by(Product.sold_count.desc())
     elif sort_by == 'created_at':
         query = query.order_by(Product.created_at.desc())
+    elif rank is not None:
+        # 有关键词时默认按 bm25 相关度排序
+        query = query.order_by(rank.asc(), Product.id.desc())
     else:
         query = query.order_by(Product.created_at.desc())
 
     pagination = paginate(query, page=page, per_page=12)
 
-    all_tags = []
-    for product in Product.query.filter_by(is_active=True).all():
-        if product.tags:
-            tags_list = product.tags.split(',')
-            all_tags.extend(tags_list)
-    tags_list = list(set(all_tags))
+    tags_list = cached_fragment('product_list:tags', lambda: [tag for tag, _ in get_tag_counts()])
 
-    return render_template('product/list.html',
+    html = render_template('product/list.html',
                            pagination=pagination,
                            tags=tags_list,
                            min_price=min_price,
                            max_price=max_price,
                            search_query=search_query,
                            sort_by=sort_by)
+    if cacheable:
+        set_cached_page('product_list', html)
+    return html
 
 @product_bp.route('/detail/<int:product_id>')
 def product_detail(product_id):
@@ -65,8 +77,9 @@ def product_detail(product_id):
         flash('该商品已下架', 'warning')
         return redirect(url_for('product.product_list'))
 
-    product.view_count += 1
-    db.session.commit()
+    # 浏览量先在进程内累计，由后台线程批量写回
+    view_counter.record(product.id)
+    view_count = (product.view_count or 0) + view_counter.pending(product.id)
 
     related_products = Product.query.filter(
         Product.id != product_id,
@@ -75,6 +88,5 @@ def product_detail(product_id):
 
     return render_template('product/detail.html',
                            product=product,
+                           view_count=view_count,
                            related_products=related_products)
-
-# 搜索功能已移除
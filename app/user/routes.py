@@ -4,7 +4,8 @@ from app.user import user_bp
 from app.models import User, Order_Core, InviteRelation, EarningRecord, WithdrawalRequest
 from app.extensions import db, bcrypt
 from app.utils.image_processor import ImageProcessor
-from app.utils.pagination import paginate
+from app.utils.image_jobs import image_jobs
+from app.utils.pagination import paginate, keyset_paginate
 from datetime import datetime
 
 @user_bp.route('/profile')
@@ -44,13 +45,16 @@ def update_profile():
             return redirect(url_for('user.profile_edit'))
         current_user.invite_code = invite_code
     
+    avatar_filename = None
     if avatar:
         image_processor = ImageProcessor(current_app.config['UPLOAD_FOLDER'])
-        avatar_filename = image_processor.process_uploaded_image(avatar, 'avatars')
+        avatar_filename = image_processor.save_original(avatar, 'avatars')
         if avatar_filename:
             current_user.avatar_filename = avatar_filename
     
     db.session.commit()
+    if avatar_filename:
+        image_jobs.enqueue(avatar_filename, 'user', current_user.id, 'avatar_filename')
     flash('个人资料已更新', 'success')
     return redirect(url_for('user.profile'))
 
@@ -123,10 +127,8 @@ def invite_management():
 @user_bp.route('/earnings')
 @login_required
 def earnings():
-    page = request.args.get('page', 1, type=int)
-    
-    query = EarningRecord.query.filter_by(user_id=current_user.id).order_by(EarningRecord.created_at.desc())
-    pagination = paginate(query, page=page, per_page=20)
+    query = EarningRecord.query.filter_by(user_id=current_user.id)
+    pagination = keyset_paginate(query, [EarningRecord.created_at, EarningRecord.id], per_page=20, count=None)
     
     total_earned = current_user.total_earned
     balance_available = current_user.balance_available
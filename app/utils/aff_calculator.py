@@ -1,7 +1,14 @@
+import os
+import socket
+import threading
+import time
 from datetime import datetime, timedelta
-from app.models import EarningRecord, User
+from app.models import EarningRecord, SettlementRun, User
 from app.extensions import db
 
+# 结算批次租约；每块提交时续租，超时未续租视为持有进程已退出，允许其他进程接手
+SETTLEMENT_LEASE_SECONDS = 300
+
 class AffiliateCalculator:
     def __init__(self, commission_rate=0.1):
         self.commission_rate = commission_rate
@@ -33,29 +40,135 @@ class AffiliateCalculator:
         
         return earning_record
     
-    def settle_earnings(self, settlement_period=7):
-        """结算收益"""
-        # 查找达到结算周期的待结算收益
-        cutoff_date = datetime.utcnow() - timedelta(days=settlement_period)
-        pending_earnings = EarningRecord.query.filter(
-            EarningRecord.status == 'pending',
-            EarningRecord.created_at <= cutoff_date
-        ).all()
-        
-        for earning in pending_earnings:
-            # 更新收益状态
-            earning.status = 'available'
-            earning.settled_at = datetime.utcnow()
-            
-            # 更新用户余额
-            user = User.query.get(earning.user_id)
-            if user:
-                user.balance_pending -= earning.amount
-                user.balance_available += earning.amount
-        
-        db.session.commit()
-        
-        return len(pending_earnings)
+    def settle_earnings(self, settlement_period=7, chunk_size=1000):
+        """
+        结算收益：把到期的待结算收益按 id 分块转为可用余额，每块一个事务。
+        每块内用一条 UPDATE 翻转收益状态，按用户 GROUP BY 汇总金额后用一条 UPDATE 调整余额；
+        每块提交时同时保存检查点，进程中断后再次调用会从上次的检查点继续。
+        批次通过租约独占，其他进程正在推进时返回 None。
+        返回本次结算的统计：{'run_id', 'records', 'users', 'amount', 'chunks', 'duration', 'resumed'}
+        """
+        started = time.monotonic()
+        owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        lease = timedelta(seconds=SETTLEMENT_LEASE_SECONDS)
+        now = datetime.utcnow()
+
+        run = SettlementRun.query.filter_by(status='running').order_by(SettlementRun.id.desc()).first()
+        resumed = run is not None
+        if run is None:
+            run = SettlementRun(
+                cutoff=now - timedelta(days=settlement_period),
+                lease_owner=owner,
+                lease_until=now + lease
+            )
+            db.session.add(run)
+            db.session.commit()
+        else:
+            # 只接手租约已过期的批次（持有它的进程已退出），同一批次不会被两个进程同时推进
+            claimed = SettlementRun.query.filter(
+                SettlementRun.id == run.id,
+                SettlementRun.status == 'running',
+                db.or_(SettlementRun.lease_until.is_(None), SettlementRun.lease_until < now)
+            ).update({
+                SettlementRun.lease_owner: owner,
+                SettlementRun.lease_until: now + lease
+            }, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                return None
+        run_id, cutoff, last_id, run_started_at = run.id, run.cutoff, run.last_id, run.started_at
+        held = db.and_(SettlementRun.id == run_id, SettlementRun.lease_owner == owner)
+
+        records = EarningRecord.__table__
+        users = User.__table__
+        try:
+            while True:
+                matured = db.and_(
+                    records.c.status == 'pending',
+                    records.c.created_at <= cutoff,
+                    records.c.id > last_id
+                )
+                chunk = db.select(records.c.id).where(matured).order_by(records.c.id).limit(chunk_size).subquery()
+                chunk_end = db.session.execute(db.select(db.func.max(chunk.c.id))).scalar()
+                if chunk_end is None:
+                    break
+
+                settled_at = datetime.utcnow()
+                in_chunk = db.and_(records.c.id > last_id, records.c.id <= chunk_end)
+                flipped = db.session.execute(
+                    db.update(records).where(matured, in_chunk).values(status='available', settled_at=settled_at)
+                ).rowcount
+
+                # 本块刚转为可用的收益，按用户汇总
+                settled = db.and_(in_chunk, records.c.status == 'available', records.c.settled_at == settled_at)
+                totals = db.session.execute(
+                    db.select(records.c.user_id, db.func.sum(records.c.amount))
+                    .where(settled).group_by(records.c.user_id)
+                ).all()
+                delta = db.select(db.func.coalesce(db.func.sum(records.c.amount), 0.0)).where(
+                    settled, records.c.user_id == users.c.id
+                ).scalar_subquery()
+                if totals:
+                    db.session.execute(
+                        db.update(users).where(users.c.id.in_([user_id for user_id, _ in totals])).values(
+                            balance_pending=db.func.coalesce(users.c.balance_pending, 0.0) - delta,
+                            balance_available=db.func.coalesce(users.c.balance_available, 0.0) + delta
+                        )
+                    )
+
+                # 检查点与本块在同一事务提交并续租；租约已被接手时放弃本块
+                checkpoint = SettlementRun.query.filter(held).update({
+                    SettlementRun.last_id: chunk_end,
+                    SettlementRun.records: SettlementRun.records + flipped,
+                    SettlementRun.amount: SettlementRun.amount + sum(amount or 0.0 for _, amount in totals),
+                    SettlementRun.chunks: SettlementRun.chunks + 1,
+                    SettlementRun.lease_until: datetime.utcnow() + lease
+                }, synchronize_session=False)
+                if not checkpoint:
+                    db.session.rollback()
+                    return None
+                db.session.commit()
+                last_id = chunk_end
+
+            # 按检查点范围统计本批次涉及的用户数（包括中断前已提交的块）
+            user_count = db.session.execute(
+                db.select(db.func.count(db.distinct(records.c.user_id))).where(
+                    records.c.id <= last_id,
+                    records.c.status != 'pending',
+                    records.c.settled_at >= run_started_at
+                )
+            ).scalar()
+            finished = SettlementRun.query.filter(held).update({
+                SettlementRun.users: user_count,
+                SettlementRun.status: 'done',
+                SettlementRun.finished_at: datetime.utcnow(),
+                SettlementRun.lease_owner: None,
+                SettlementRun.lease_until: None
+            }, synchronize_session=False)
+            db.session.commit()
+            if not finished:
+                return None
+        except Exception as e:
+            db.session.rollback()
+            # 保留 running 状态与检查点并释放租约，下一次调用从这里继续
+            SettlementRun.query.filter(held).update({
+                SettlementRun.error: str(e)[:1000],
+                SettlementRun.lease_owner: None,
+                SettlementRun.lease_until: None
+            }, synchronize_session=False)
+            db.session.commit()
+            raise
+
+        run = db.session.get(SettlementRun, run_id, populate_existing=True)
+        return {
+            'run_id': run.id,
+            'records': run.records,
+            'users': run.users,
+            'amount': run.amount,
+            'chunks': run.chunks,
+            'duration': time.monotonic() - started,
+            'resumed': resumed
+        }
     
     def process_withdrawal(self, withdrawal_request):
         """处理提现申请"""
@@ -0,0 +1,47 @@
+from datetime import datetime
+from app.extensions import db
+from app.models import Cart
+from app.utils.sql_helpers import dialect_insert
+
+# 仅修改受影响的购物车行，依赖 (user_id, product_id) 唯一索引
+
+def add_item(user_id, product_id, quantity):
+    """加入购物车：已存在则累加数量（INSERT ... ON CONFLICT DO UPDATE）"""
+    insert = dialect_insert()
+    if insert is not None:
+        table = Cart.__table__
+        stmt = insert(table).values(
+            user_id=user_id,
+            product_id=product_id,
+            quantity=quantity,
+            added_at=datetime.utcnow()
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.product_id],
+            set_={'quantity': table.c.quantity + stmt.excluded.quantity}
+        )
+        db.session.execute(stmt)
+    else:
+        updated = Cart.query.filter_by(user_id=user_id, product_id=product_id).update(
+            {Cart.quantity: Cart.quantity + quantity}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(Cart(user_id=user_id, product_id=product_id, quantity=quantity))
+    db.session.commit()
+
+def set_quantity(user_id, product_id, quantity):
+    """修改购物车中某商品的数量"""
+    Cart.query.filter_by(user_id=user_id, product_id=product_id).update(
+        {Cart.quantity: quantity}, synchronize_session=False
+    )
+    db.session.commit()
+
+def remove_item(user_id, product_id):
+    """从购物车移除某商品"""
+    Cart.query.filter_by(user_id=user_id, product_id=product_id).delete(synchronize_session=False)
+    db.session.commit()
+
+def clear(user_id):
+    """清空购物车"""
+    Cart.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    db.session.commit()
@@ -0,0 +1,238 @@
+import codecs
+import hashlib
+import itertools
+import os
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, request
+from app.extensions import db
+from app.models import CDKey, CDKeyImport
+from app.utils.inventory import adjust_cdkey_stock
+from app.utils.sql_helpers import dialect_insert
+
+def cdkey_hash(key):
+    """卡密去重用的定长哈希（sha256 前 32 位十六进制）"""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+def iter_key_lines(stream, encoding='utf-8-sig', block_size=64 * 1024):
+    """逐块读取二进制流并按行产出去掉首尾空白的卡密，不把整个文件读进内存"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    tail = ''
+    while True:
+        block = stream.read(block_size)
+        text = decoder.decode(block, final=not block)
+        lines = (tail + text).splitlines(keepends=True)
+        tail = ''
+        if lines and not lines[-1].endswith(('\n', '\r')) and block:
+            tail = lines.pop()
+        for line in lines:
+            key = line.strip()
+            if key:
+                yield key
+        if not block:
+            break
+
+def _insert_chunk(product_id, keys):
+    """写入一块卡密，返回实际新增的条数；(product_id, key_hash) 已存在的卡密被跳过"""
+    rows = {}
+    for key in keys:
+        rows.setdefault(cdkey_hash(key), key)
+    if not rows:
+        return 0
+
+    table = CDKey.__table__
+    params = [
+        {'product_id': product_id, 'key': key, 'key_hash': key_hash, 'status': 'unsold'}
+        for key_hash, key in rows.items()
+    ]
+    insert = dialect_insert()
+    if insert is not None:
+        stmt = insert(table).on_conflict_do_nothing(
+            index_elements=[table.c.product_id, table.c.key_hash]
+        ).returning(table.c.id)
+        return len(db.session.execute(stmt, params).all())
+
+    # 不支持 ON CONFLICT 的数据库：先查出已存在的哈希再插入其余
+    existing = {
+        key_hash for (key_hash,) in db.session.query(CDKey.key_hash).filter(
+            CDKey.product_id == product_id,
+            CDKey.key_hash.in_(list(rows))
+        )
+    }
+    params = [row for row in params if row['key_hash'] not in existing]
+    if params:
+        db.session.execute(db.insert(table), params)
+    return len(params)
+
+def import_cdkeys(product_id, keys, chunk_size=None, on_progress=None):
+    """
+    按块导入卡密，每块一个事务：批量插入、按实际新增数调整库存计数后提交。
+    on_progress(processed, added, duplicates) 在每块提交后调用。返回 (added, duplicates)。
+    """
+    chunk_size = chunk_size or current_app.config.get('CDKEY_IMPORT_CHUNK_SIZE', 5000)
+    processed = added = 0
+    chunk = []
+
+    def flush():
+        nonlocal added
+        try:
+            inserted = _insert_chunk(product_id, chunk)
+            if inserted:
+                adjust_cdkey_stock(product_id, inserted)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        added += inserted
+        chunk.clear()
+        if on_progress:
+            on_progress(processed, added, processed - added)
+
+    for key in keys:
+        chunk.append(key)
+        processed += 1
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    if added:
+        from app.utils.pagination import clear_count_cache
+        clear_count_cache()
+    return added, processed - added
+
+def raise_upload_limit():
+    """
+    卡密文件可能远大于全局上传限制，为导入路由单独放宽请求体大小。
+    CSRF 校验会在视图之前解析表单，所以须注册在 csrf.init_app 之前；只对管理员放宽。
+    """
+    if request.endpoint != 'admin.import_cdkeys_file':
+        return
+    from flask_login import current_user
+    if current_user.is_authenticated and current_user.role in ('admin', 'moderator'):
+        request.max_content_length = current_app.config['CDKEY_IMPORT_MAX_SIZE']
+
+def _import_path(app, import_id):
+    return os.path.join(app.config['CDKEY_IMPORT_DIR'], f'{import_id}.txt')
+
+def _start_thread(app, import_id):
+    thread = threading.Thread(target=_run_import, args=(app, import_id), name=f'cdkey-import-{import_id}', daemon=True)
+    thread.start()
+
+def start_import(product_id, file_storage):
+    """保存上传的卡密文件并登记导入任务，由后台线程流式导入，返回 CDKeyImport"""
+    app = current_app._get_current_object()
+    os.makedirs(app.config['CDKEY_IMPORT_DIR'], exist_ok=True)
+
+    job = CDKeyImport(product_id=product_id, filename=(file_storage.filename or '')[:200])
+    db.session.add(job)
+    db.session.commit()
+    file_storage.save(_import_path(app, job.id))
+
+    _start_thread(app, job.id)
+    return job
+
+def _run_import(app, import_id):
+    path = _import_path(app, import_id)
+    with app.app_context():
+        job = db.session.get(CDKeyImport, import_id)
+        product_id = job.product_id
+        # 续跑时跳过此前已提交的部分，进度在原有计数上累加
+        skip, base_added = job.processed, job.added
+
+        def report(processed, added, duplicates):
+            CDKeyImport.query.filter_by(id=import_id).update({
+                CDKeyImport.processed: skip + processed,
+                CDKeyImport.added: base_added + added,
+                CDKeyImport.duplicates: skip - base_added + duplicates,
+                CDKeyImport.updated_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+
+        try:
+            CDKeyImport.query.filter_by(id=import_id).update({
+                CDKeyImport.status: 'running',
+                CDKeyImport.updated_at: datetime.utcnow()
+            })
+            db.session.commit()
+            with open(path, 'rb') as f:
+                import_cdkeys(product_id, itertools.islice(iter_key_lines(f), skip, None), on_progress=report)
+            CDKeyImport.query.filter_by(id=import_id).update({
+                CDKeyImport.status: 'done',
+                CDKeyImport.finished_at: datetime.utcnow()
+            })
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"卡密导入 {import_id} 失败: {e}")
+            CDKeyImport.query.filter_by(id=import_id).update({
+                CDKeyImport.status: 'failed',
+                CDKeyImport.error: str(e)[:1000],
+                CDKeyImport.finished_at: datetime.utcnow()
+            })
+            db.session.commit()
+        finally:
+            db.session.remove()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def resume_stale_imports():
+    """
+    续跑心跳超过 CDKEY_IMPORT_STALE_SECONDS 未更新的导入任务（执行它的进程已退出），
+    上传文件已不存在的任务标记为失败。返回续跑的任务数。
+    """
+    app = current_app._get_current_object()
+    stale_before = datetime.utcnow() - timedelta(seconds=app.config['CDKEY_IMPORT_STALE_SECONDS'])
+    stale = db.and_(
+        CDKeyImport.status.in_(['pending', 'running']),
+        db.or_(CDKeyImport.updated_at.is_(None), CDKeyImport.updated_at < stale_before)
+    )
+
+    resumed = 0
+    for (import_id,) in db.session.query(CDKeyImport.id).filter(stale).order_by(CDKeyImport.id).all():
+        # 条件更新刷新心跳，多个进程同时检查时只有一个接手
+        claimed = CDKeyImport.query.filter(CDKeyImport.id == import_id, stale).update(
+            {CDKeyImport.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            continue
+
+        if not os.path.exists(_import_path(app, import_id)):
+            CDKeyImport.query.filter_by(id=import_id).update({
+                CDKeyImport.status: 'failed',
+                CDKeyImport.error: '导入中断且上传文件已不存在，请重新上传',
+                CDKeyImport.finished_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+            continue
+
+        _start_thread(app, import_id)
+        resumed += 1
+    return resumed
+
+def backfill_key_hashes(chunk_size=5000):
+    """为旧卡密补全 key_hash；同一商品下重复的卡密只给最早一条写哈希（不提交事务）"""
+    seen = set()
+    last_id = 0
+    while True:
+        rows = db.session.query(CDKey.id, CDKey.product_id, CDKey.key).filter(
+            CDKey.id > last_id
+        ).order_by(CDKey.id).limit(chunk_size).all()
+        if not rows:
+            break
+        params = []
+        for cdkey_id, product_id, key in rows:
+            key_hash = cdkey_hash(key)
+            if (product_id, key_hash) not in seen:
+                seen.add((product_id, key_hash))
+                params.append({'b_id': cdkey_id, 'b_hash': key_hash})
+        if params:
+            table = CDKey.__table__
+            db.session.execute(
+                db.update(table).where(table.c.id == db.bindparam('b_id')).values(key_hash=db.bindparam('b_hash')),
+                params
+            )
+        last_id = rows[-1][0]
@@ -1,11 +1,13 @@
 import base64
 import hashlib
+from functools import lru_cache
 from cryptography.fernet import Fernet
 
 def _derive_key(secret_key: str) -> bytes:
     digest = hashlib.sha256(secret_key.encode('utf-8')).digest()
     return base64.urlsafe_b64encode(digest)
 
+@lru_cache(maxsize=8)
 def _get_fernet(secret_key: str) -> Fernet:
     return Fernet(_derive_key(secret_key))
 
@@ -13,6 +15,8 @@ def encrypt_text(plain_text: str, secret_key: str) -> str:
     f = _get_fernet(secret_key)
     return f.encrypt(plain_text.encode('utf-8')).decode('utf-8')
 
+# 同一 (SECRET_KEY, 密文) 的解密结果不变，缓存后批量上传不必重复解密
+@lru_cache(maxsize=32)
 def decrypt_text(cipher_text: str, secret_key: str) -> str:
     f = _get_fernet(secret_key)
     return f.decrypt(cipher_text.encode('utf-8')).decode('utf-8')
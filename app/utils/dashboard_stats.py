@@ -0,0 +1,76 @@
+import time
+from datetime import date, datetime
+from app.extensions import cache, db
+from app.models import Product, OrderDailyRollup
+from app.utils.order_rollup import ALL_STATUS, PAID_STATUSES
+
+PENDING_STATUSES = ('pending_payment', 'user_paid', 'shipped')
+
+# 统计快照存放在共享缓存中（见 CACHE_TYPE），键带版本号：订单状态变化时换新版本，所有 worker 同时失效，
+# 失效前开始计算的旧结果写在旧版本键下，不会被读到
+VERSION_KEY = 'dashboard:version'
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=0)
+        version = cache.get(VERSION_KEY) or 0
+    return version
+
+def invalidate_dashboard_stats():
+    """订单状态变化后调用，使统计快照失效"""
+    cache.set(VERSION_KEY, time.time_ns(), timeout=0)
+
+def get_dashboard_stats(ttl=60):
+    """返回后台首页统计数据（带TTL缓存）"""
+    key = f'dashboard:stats:{_version()}'
+    data = cache.get(key)
+    if data is None:
+        data = compute_dashboard_stats()
+        cache.set(key, data, timeout=ttl)
+    return data
+
+def compute_dashboard_stats(now=None):
+    """只读取 order_daily_rollup 日汇总表，耗时与订单总量无关"""
+    today = (now or datetime.utcnow()).date()
+
+    today_orders = 0
+    today_sales = 0.0
+    today_users = 0
+    monthly_totals = [0.0] * 12
+    for day, status, order_count, amount, new_users in db.session.query(
+        OrderDailyRollup.day,
+        OrderDailyRollup.status,
+        OrderDailyRollup.order_count,
+        OrderDailyRollup.amount,
+        OrderDailyRollup.new_users
+    ).filter(OrderDailyRollup.day >= date(today.year, 1, 1)):
+        if status == ALL_STATUS:
+            if day == today:
+                today_orders = order_count
+                today_users = new_users
+        elif status in PAID_STATUSES:
+            if day == today:
+                today_sales += amount
+            monthly_totals[day.month - 1] += amount
+
+    status_totals = {
+        status: (order_count or 0, new_users or 0)
+        for status, order_count, new_users in db.session.query(
+            OrderDailyRollup.status,
+            db.func.sum(OrderDailyRollup.order_count),
+            db.func.sum(OrderDailyRollup.new_users)
+        ).group_by(OrderDailyRollup.status)
+    }
+
+    return {
+        'today_orders': today_orders,
+        'today_sales': today_sales,
+        'today_users': today_users,
+        'total_users': status_totals.get(ALL_STATUS, (0, 0))[1],
+        'total_products': Product.query.count(),
+        'total_orders': status_totals.get(ALL_STATUS, (0, 0))[0],
+        'pending_orders': sum(status_totals.get(status, (0, 0))[0] for status in PENDING_STATUSES),
+        # 图表展示上半年（1-6月）
+        'monthly_sales': [float(amount) for amount in monthly_totals[:6]]
+    }
@@ -0,0 +1,215 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from app.extensions import db
+from app.models import FulfillmentJob, Order_Core
+from app.utils.inventory import claim_cdkeys
+from app.utils.sql_helpers import dialect_insert
+
+# 任务最多尝试次数；运行中超过租约时间仍未完成的任务视为 worker 已崩溃，重新领取
+MAX_ATTEMPTS = 5
+LEASE_SECONDS = 120
+
+def claim_order_for_shipping(order):
+    """把订单从 user_paid 原子地占为发货中（不提交事务）；已被其他管理员或 worker 处理时返回 False"""
+    claimed = Order_Core.query.filter_by(id=order.id, cached_status='user_paid').update(
+        {Order_Core.cached_status: 'shipped'}, synchronize_session=False
+    )
+    # cached_status 仍为旧值，随后由 change_order_status 写入并同步日汇总
+    return claimed == 1
+
+class FulfillmentWorker:
+    """
+    卡密订单自动发货（AUTO_FULFILLMENT 开启时）：收款经过确认（管理员标记已支付、确认用户声明的付款或支付网关回调）时
+    在同一事务中写入 fulfillment_job，提交后唤醒本进程的 worker 线程；worker 批量领取任务，
+    为订单领取卡密、写入订单状态并把 cached_status 改为 shipped。卡密不足的订单留给管理员手动发货。
+    用户自己声明已支付不会触发自动发货。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._state_manager = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('AUTO_FULFILLMENT', False)
+        self.workers = app.config.get('FULFILLMENT_WORKERS', 1)
+        self.batch_size = app.config.get('FULFILLMENT_BATCH_SIZE', 20)
+        self.poll_interval = app.config.get('FULFILLMENT_POLL_INTERVAL', 5)
+        app.extensions['fulfillment'] = self
+        # 每个进程收到第一个请求时启动 worker，接着处理上次遗留的任务
+        app.before_request(self.ensure_workers)
+
+    @property
+    def state_manager(self):
+        if self._state_manager is None:
+            from app.utils.order_state_manager import OrderStateManager
+            config = self.app.config
+            self._state_manager = OrderStateManager(
+                config['ORDER_STATE_DATA_DIR'],
+                config['ORDER_STATE_BACKEND'],
+                cache_size=0,
+                fsync=config['ORDER_STATE_FSYNC']
+            )
+        return self._state_manager
+
+    def enqueue(self, order_id):
+        """登记待发货订单（不提交事务，与支付状态一起提交）；同一订单重复登记会被忽略，未开启自动发货时不登记"""
+        if not self.enabled:
+            return
+        now = datetime.utcnow()
+        values = {'order_id': order_id, 'status': 'pending', 'attempts': 0,
+                  'run_after': now, 'created_at': now, 'updated_at': now}
+        insert = dialect_insert()
+        if insert is not None:
+            db.session.execute(insert(FulfillmentJob.__table__).values(**values).on_conflict_do_nothing(
+                index_elements=[FulfillmentJob.__table__.c.order_id]
+            ))
+        elif not FulfillmentJob.query.filter_by(order_id=order_id).first():
+            db.session.add(FulfillmentJob(**values))
+
+    def notify(self):
+        """收款确认提交后调用：唤醒 worker，未启用后台线程时在当前请求内处理"""
+        if not self.enabled:
+            return
+        if self.workers <= 0:
+            self.run_pending()
+            return
+        self.ensure_workers()
+        self._wakeup.set()
+
+    def ensure_workers(self):
+        """按进程启动 worker 线程（fork 后的子进程会重新启动）"""
+        if not self.enabled or self.workers <= 0 or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'fulfillment-{i}', daemon=True)
+                thread.start()
+            self._pid = os.getpid()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                processed = self.run_pending()
+            except Exception as e:
+                print(f"自动发货 worker 出错: {e}")
+                processed = 0
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_pending(self):
+        """领取并处理一批到期任务，返回处理的任务数"""
+        with self.app.app_context():
+            try:
+                jobs = self._claim()
+                for job_id, order_id, attempts in jobs:
+                    self._run(job_id, order_id, attempts)
+                return len(jobs)
+            finally:
+                db.session.remove()
+
+    def _claim(self):
+        """领取一批任务（跨进程安全），返回 [(job_id, order_id, attempts)]"""
+        now = datetime.utcnow()
+        table = FulfillmentJob.__table__
+        due = db.or_(
+            db.and_(table.c.status == 'pending', table.c.run_after <= now),
+            db.and_(table.c.status == 'running', table.c.updated_at < now - timedelta(seconds=LEASE_SECONDS))
+        )
+        candidates = db.select(table.c.id).where(due).order_by(table.c.id).limit(self.batch_size)
+        dialect = db.session.get_bind().dialect
+        if dialect.name == 'postgresql':
+            candidates = candidates.with_for_update(skip_locked=True)
+        values = {'status': 'running', 'attempts': table.c.attempts + 1, 'updated_at': now}
+
+        try:
+            if dialect.update_returning and dialect.name in ('sqlite', 'postgresql'):
+                rows = db.session.execute(
+                    db.update(table).where(table.c.id.in_(candidates.scalar_subquery()), due)
+                    .values(**values)
+                    .returning(table.c.id, table.c.order_id, table.c.attempts)
+                ).all()
+            else:
+                ids = list(db.session.execute(candidates.with_for_update()).scalars())
+                rows = []
+                if ids:
+                    db.session.execute(db.update(table).where(table.c.id.in_(ids), due).values(**values))
+                    rows = db.session.execute(
+                        db.select(table.c.id, table.c.order_id, table.c.attempts)
+                        .where(table.c.id.in_(ids), table.c.status == 'running', table.c.updated_at == now)
+                    ).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return sorted(tuple(row) for row in rows)
+
+    def _finish(self, job_id, status, error=None, run_after=None):
+        values = {
+            FulfillmentJob.status: status,
+            FulfillmentJob.last_error: error,
+            FulfillmentJob.updated_at: datetime.utcnow()
+        }
+        if run_after is not None:
+            values[FulfillmentJob.run_after] = run_after
+        FulfillmentJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+
+    def _run(self, job_id, order_id, attempts):
+        from app.utils.order_rollup import change_order_status
+        from app.utils.dashboard_stats import invalidate_dashboard_stats
+
+        try:
+            order = db.session.get(Order_Core, order_id)
+            # 订单已被管理员发货、取消或不存在时直接结束，保证重复领取不会重复发货
+            if order is None or not claim_order_for_shipping(order):
+                self._finish(job_id, 'skipped')
+                db.session.commit()
+                return
+
+            lines = [(item.product_id, item.quantity) for item in order.order_items]
+            claimed = claim_cdkeys(order.id, lines)
+            if not lines or any(len(claimed.get(product_id, [])) < quantity for product_id, quantity in lines):
+                # 卡密不足（或不是卡密商品）：释放已领取的卡密，留给管理员手动发货
+                db.session.rollback()
+                self._finish(job_id, 'manual')
+                db.session.commit()
+                return
+
+            assigned_keys = [key for _, keys in sorted(claimed.items()) for key in keys]
+            change_order_status(order, 'shipped')
+            self._finish(job_id, 'done')
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"订单 {order_id} 自动发货失败: {e}")
+            if attempts >= MAX_ATTEMPTS:
+                self._finish(job_id, 'failed', error=str(e)[:1000])
+            else:
+                self._finish(job_id, 'pending', error=str(e)[:1000],
+                             run_after=datetime.utcnow() + timedelta(seconds=2 ** attempts))
+            db.session.commit()
+            return
+
+        # 订单状态在数据库提交之后写入：提交失败重试时重新领取的卡密不会与上次的记录重复；
+        # 任务已标记完成，不会再次写入
+        try:
+            with self.state_manager.batch():
+                self.state_manager.assign_cdkey(order_id, assigned_keys)
+                self.state_manager.update_state(order_id, 'shipped', '卡密已自动发货')
+        except Exception as e:
+            # 卡密已在 cdkey 表中记到订单名下，这里只留下错误供管理员核对
+            print(f"订单 {order_id} 已自动发货，但写入订单状态失败: {e}")
+            self._finish(job_id, 'done', error=str(e)[:1000])
+            db.session.commit()
+        invalidate_dashboard_stats()
+
+fulfillment = FulfillmentWorker()
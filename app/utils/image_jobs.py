@@ -0,0 +1,227 @@
+import os
+import sqlite3
+import threading
+import time
+from app.extensions import db
+
+# 任务最多尝试次数；运行中超过租约时间仍未完成的任务视为 worker 已崩溃，重新领取
+MAX_ATTEMPTS = 3
+LEASE_SECONDS = 300
+
+def _targets():
+    from app.models import Product, User, SiteSetting
+    return {'product': Product, 'user': User, 'site_setting': SiteSetting}
+
+class ImageJobQueue:
+    """
+    图片后台任务队列：请求线程只保存原图并入队，缩略图与远程上传由后台线程完成，
+    完成后把结果回写到 目标模型.字段。队列持久化在单独的 SQLite 文件中，进程重启后继续处理。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.db_path = app.config['IMAGE_JOB_DB']
+        self.workers = app.config['IMAGE_JOB_WORKERS']
+        self.poll_interval = app.config.get('IMAGE_JOB_POLL_INTERVAL', 5)
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+        app.extensions['image_jobs'] = self
+        # 每个进程收到第一个请求时启动 worker，接着处理上次遗留的任务
+        app.before_request(self.ensure_workers)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS image_job ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "image_path TEXT NOT NULL, "
+                "target_model TEXT NOT NULL, "
+                "target_id INTEGER NOT NULL, "
+                "target_field TEXT NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "run_after REAL NOT NULL, "
+                "result TEXT, "
+                "last_error TEXT, "
+                "created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_image_job_status_run_after "
+                "ON image_job (status, run_after)"
+            )
+        finally:
+            conn.close()
+
+    def enqueue(self, image_path, target_model, target_id, target_field):
+        """登记一张已保存的原图，处理完成后回写 target_model(target_id).target_field"""
+        if target_model not in _targets():
+            raise ValueError(f'未知的回写目标: {target_model}')
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            job_id = conn.execute(
+                "INSERT INTO image_job (image_path, target_model, target_id, target_field, "
+                "run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image_path, target_model, target_id, target_field, now, now, now)
+            ).lastrowid
+        finally:
+            conn.close()
+
+        if self.workers <= 0:
+            # 未启用后台线程时在当前请求内同步处理
+            job = self._claim(job_id)
+            if job:
+                self._run(job)
+        else:
+            self.ensure_workers()
+            self._wakeup.set()
+        return job_id
+
+    def ensure_workers(self):
+        """按进程启动 worker 线程（fork 后的子进程会重新启动）"""
+        if self.workers <= 0 or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'image-job-{i}', daemon=True)
+                thread.start()
+            self._pid = os.getpid()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"领取图片任务失败: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _claim(self, job_id=None):
+        """领取一个待处理任务（跨进程安全），返回 (id, image_path, model, target_id, field, attempts)"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            sql = (
+                "SELECT id, image_path, target_model, target_id, target_field, attempts FROM image_job "
+                "WHERE ((status = 'pending' AND run_after <= ?) OR (status = 'running' AND updated_at < ?))"
+            )
+            params = [now, now - LEASE_SECONDS]
+            if job_id is not None:
+                sql += " AND id = ?"
+                params.append(job_id)
+            row = conn.execute(sql + " ORDER BY id LIMIT 1", params).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE image_job SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (now, row[0])
+                )
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id, status, result=None, error=None, run_after=None):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE image_job SET status = ?, result = ?, last_error = ?, "
+                "run_after = COALESCE(?, run_after), updated_at = ? WHERE id = ?",
+                (status, result, error, run_after, now, job_id)
+            )
+        finally:
+            conn.close()
+
+    def _run(self, job):
+        from app.utils.image_processor import ImageProcessor
+
+        job_id, image_path, target_model, target_id, target_field, attempts = job
+        with self.app.app_context():
+            try:
+                image_processor = ImageProcessor(self.app.config['UPLOAD_FOLDER'])
+                result = image_processor.process_saved_image(image_path)
+                if result and result != image_path:
+                    self._apply(image_processor, image_path, result, target_model, target_id, target_field)
+                if target_model == 'product':
+                    # 新的变体或远程地址要体现在缓存的前台页面中
+                    from app.utils.storefront_cache import invalidate_storefront
+                    invalidate_storefront()
+                self._finish(job_id, 'done', result=result)
+            except Exception as e:
+                db.session.rollback()
+                print(f"图片任务 {job_id} 处理失败: {e}")
+                if attempts + 1 >= MAX_ATTEMPTS:
+                    self._finish(job_id, 'failed', error=str(e))
+                else:
+                    self._finish(job_id, 'pending', error=str(e), run_after=time.time() + 5 * 2 ** attempts)
+
+    def _apply(self, image_processor, image_path, result, target_model, target_id, target_field):
+        """回写处理结果；仅当字段仍指向本任务的原图时才覆盖，避免覆盖期间新上传的图片"""
+        model = _targets()[target_model]
+        column = getattr(model, target_field)
+        updated = model.query.filter(model.id == target_id, column == image_path).update(
+            {column: result}, synchronize_session=False
+        )
+        db.session.commit()
+
+        if updated:
+            image_processor.release_image(image_path)
+            if target_model == 'site_setting':
+                from app.utils.site_settings import invalidate_site_settings
+                invalidate_site_settings()
+            elif target_model == 'product':
+                # 缓存的前台页面还引用着已释放的旧图片地址
+                from app.utils.storefront_cache import invalidate_storefront
+                invalidate_storefront()
+
+    def purge_finished(self, older_than):
+        """删除 older_than 秒之前已完成的任务，返回删除的行数"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "DELETE FROM image_job WHERE status = 'done' AND updated_at < ?",
+                (time.time() - older_than,)
+            ).rowcount
+        finally:
+            conn.close()
+
+    def status(self, job_id):
+        """查询任务状态：pending / running / done / failed，任务不存在时返回 None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT status FROM image_job WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+image_jobs = ImageJobQueue()
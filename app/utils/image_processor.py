@@ -1,12 +1,86 @@
 import os
 import base64
-import uuid
+import hashlib
+import tempfile
+import threading
+from functools import lru_cache
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image, features
 from flask import current_app
-from app.models import SiteSetting
+from app.utils.site_settings import get_site_settings
 from app.utils.crypto import decrypt_text
 
+# 进程内复用的 GitHub API 会话：保持连接，避免每张图片都重新握手 TLS
+_github_session = None
+_github_session_lock = threading.Lock()
+
+def get_github_session():
+    """返回带连接池和重试退避的 requests.Session"""
+    global _github_session
+    if _github_session is None:
+        with _github_session_lock:
+            if _github_session is None:
+                # PUT 创建文件不幂等：只重试连接失败和 429（请求未被处理），
+                # 读超时和 5xx 时请求可能已经生效，不重试，由上传处查询文件是否已存在
+                retry = Retry(
+                    total=3,
+                    connect=3,
+                    read=0,
+                    backoff_factor=0.5,
+                    status_forcelist=(429,),
+                    allowed_methods=frozenset(['GET', 'PUT']),
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _github_session = session
+    return _github_session
+
+# 变体格式 -> (Pillow 格式名, 保存参数)
+VARIANT_FORMATS = {
+    'avif': ('AVIF', {'quality': 60}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# 已确认存在的变体文件；文件名由内容哈希决定，存在即不会再变
+_known_variants = set()
+
+@lru_cache(maxsize=None)
+def _format_supported(fmt):
+    return fmt == 'jpg' or features.check(fmt)
+
+def variant_formats():
+    """按优先级返回可用的变体格式，JPEG 始终作为兜底"""
+    formats = [fmt for fmt in current_app.config.get('IMAGE_VARIANT_FORMATS', ()) if fmt in VARIANT_FORMATS and _format_supported(fmt)]
+    return [fmt for fmt in formats if fmt != 'jpg'] + ['jpg']
+
+def variant_path(image_path, size, fmt):
+    """变体的相对路径：<子目录>/variants/<原图文件名>_<尺寸>.<格式>"""
+    subfolder, filename = os.path.split(image_path)
+    stem = filename.rsplit('.', 1)[0]
+    return '/'.join(part for part in (subfolder, 'variants', f"{stem}_{size}.{fmt}") if part)
+
+def variant_sources(image_path, size):
+    """返回已生成的变体 [(格式, URL)]；远程图片或变体尚未生成时返回空列表"""
+    if not image_path or image_path.startswith('http://') or image_path.startswith('https://'):
+        return []
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    sources = []
+    for fmt in variant_formats():
+        rel_path = variant_path(image_path, size, fmt)
+        if rel_path not in _known_variants:
+            if not os.path.exists(os.path.join(upload_folder, rel_path)):
+                continue
+            _known_variants.add(rel_path)
+        sources.append((fmt, f"/uploads/{rel_path}"))
+    return sources
+
 class ImageProcessor:
     def __init__(self, upload_folder):
         self.upload_folder = upload_folder
@@ -26,39 +100,92 @@ class ImageProcessor:
         except Exception as e:
             print(f"生成缩略图失败: {e}")
             return False
+
+    def generate_variants(self, image_path):
+        """按 IMAGE_VARIANTS 为原图生成各尺寸变体（AVIF/WebP，JPEG 兜底），已存在的跳过"""
+        subfolder = os.path.dirname(image_path)
+        sizes = current_app.config.get('IMAGE_VARIANTS', {}).get(subfolder)
+        if not sizes:
+            return []
+
+        created = []
+        try:
+            with Image.open(os.path.join(self.upload_folder, image_path)) as img:
+                img.load()
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA')
+                os.makedirs(os.path.join(self.upload_folder, subfolder, 'variants'), exist_ok=True)
+                for size, box in sizes.items():
+                    resized = img.copy()
+                    resized.thumbnail(box, Image.LANCZOS)
+                    for fmt in variant_formats():
+                        rel_path = variant_path(image_path, size, fmt)
+                        output_path = os.path.join(self.upload_folder, rel_path)
+                        if os.path.exists(output_path):
+                            continue
+                        frame = resized
+                        if fmt == 'jpg' and resized.mode == 'RGBA':
+                            frame = Image.new('RGB', resized.size, (255, 255, 255))
+                            frame.paste(resized, mask=resized.getchannel('A'))
+                        pil_format, options = VARIANT_FORMATS[fmt]
+                        temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.part"
+                        frame.save(temp_path, format=pil_format, **options)
+                        os.replace(temp_path, output_path)
+                        created.append(rel_path)
+        except Exception as e:
+            print(f"生成图片变体失败: {e}")
+        return created
     
-    def process_uploaded_image(self, file, subfolder):
-        """处理上传的图片"""
-        if not self.allowed_file(file.filename):
-            return None
-
-        # 优先走 GitHub；未配置时回退到本地保存
-        setting = SiteSetting.get()
-        if setting.gh_repo and setting.gh_token_enc:
-            token = decrypt_text(setting.gh_token_enc, current_app.config['SECRET_KEY'])
-            return self._upload_to_github(file, subfolder, setting.gh_repo, setting.gh_branch or 'main', token)
-        
-        # 确保子文件夹存在
-        folder_path = os.path.join(self.upload_folder, subfolder)
-        os.makedirs(folder_path, exist_ok=True)
-        
-        # 生成唯一文件名
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{ext}"
-        file_path = os.path.join(folder_path, unique_filename)
+    def save_original(self, file, subfolder):
+        """只把原图保存到本地并返回相对路径，后续处理见 process_saved_image"""
+        if not self.allowed_file(file.filename):
+            return None
+
+        # 确保子文件夹存在
+        folder_path = os.path.join(self.upload_folder, subfolder)
+        os.makedirs(folder_path, exist_ok=True)
         
-        # 保存原始图片
-        file.save(file_path)
+        # 边写临时文件边计算哈希，按内容命名，相同图片只保存一份
+        ext = file.filename.rsplit('.', 1)[1].lower()
+        fd, temp_path = tempfile.mkstemp(dir=folder_path, suffix='.part')
+        digest = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as output:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                output.write(chunk)
+        unique_filename = f"{digest.hexdigest()[:32]}.{ext}"
+        file_path = os.path.join(folder_path, unique_filename)
+        if os.path.exists(file_path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, file_path)
         
+        # 返回相对路径（统一使用URL分隔符）
+        return os.path.join(subfolder, unique_filename).replace('\\', '/')
+
+    def process_saved_image(self, image_path):
+        """处理已保存的原图：配置了 GitHub 时上传并返回远程地址，否则生成缩略图并返回原路径"""
+        subfolder, filename = os.path.split(image_path)
+        file_path = os.path.join(self.upload_folder, image_path)
+
+        # 优先走 GitHub；未配置时回退到本地保存
+        setting, _ = get_site_settings()
+        if setting.gh_repo and setting.gh_token_enc:
+            token = decrypt_text(setting.gh_token_enc, current_app.config['SECRET_KEY'])
+            with open(file_path, 'rb') as f:
+                content_bytes = f.read()
+            ext = filename.rsplit('.', 1)[1].lower()
+            return self._upload_to_github(content_bytes, ext, subfolder, setting.gh_repo, setting.gh_branch or 'main', token)
+
         # 生成缩略图
-        thumb_folder = os.path.join(folder_path, 'thumbs')
+        thumb_folder = os.path.join(self.upload_folder, subfolder, 'thumbs')
         os.makedirs(thumb_folder, exist_ok=True)
-        thumb_path = os.path.join(thumb_folder, unique_filename)
-        self.generate_thumbnail(file_path, thumb_path)
-        
-        # 返回相对路径（统一使用URL分隔符）
-        return os.path.join(subfolder, unique_filename).replace('\\', '/')
-    
+        thumb_path = os.path.join(thumb_folder, filename)
+        if not os.path.exists(thumb_path):
+            self.generate_thumbnail(file_path, thumb_path)
+        self.generate_variants(image_path)
+        return image_path
+
     def delete_image(self, image_path):
         """删除图片及其缩略图"""
         try:
@@ -73,35 +200,81 @@ class ImageProcessor:
             thumb_path = os.path.join(self.upload_folder, os.path.dirname(image_path), 'thumbs', os.path.basename(image_path))
             if os.path.exists(thumb_path):
                 os.remove(thumb_path)
+
+            # 删除各尺寸变体
+            for size in current_app.config.get('IMAGE_VARIANTS', {}).get(os.path.dirname(image_path), {}):
+                for fmt in VARIANT_FORMATS:
+                    rel_path = variant_path(image_path, size, fmt)
+                    _known_variants.discard(rel_path)
+                    variant_file = os.path.join(self.upload_folder, rel_path)
+                    if os.path.exists(variant_file):
+                        os.remove(variant_file)
             
             return True
         except Exception as e:
             print(f"删除图片失败: {e}")
             return False
 
-    def _upload_to_github(self, file, subfolder, repo, branch, token):
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{ext}"
-        path = f"uploads/{subfolder}/{unique_filename}"
+    def release_image(self, image_path):
+        """图片不再被任何记录引用时才删除（按内容命名后同一文件可能被多处共用）"""
+        if not image_path or image_path.startswith('http://') or image_path.startswith('https://'):
+            return False
+        from app.models import Product, User, SiteSetting
+        if Product.query.filter_by(image_filename=image_path).first() \
+                or User.query.filter_by(avatar_filename=image_path).first() \
+                or SiteSetting.query.filter(
+                    (SiteSetting.site_logo == image_path) |
+                    (SiteSetting.wechat_qr == image_path) |
+                    (SiteSetting.alipay_qr == image_path) |
+                    (SiteSetting.bank_qr == image_path)
+                ).first():
+            return False
+        return self.delete_image(image_path)
 
-        content_bytes = file.read()
-        file.seek(0)
-        content_b64 = base64.b64encode(content_bytes).decode('utf-8')
+    def _upload_to_github(self, content_bytes, ext, subfolder, repo, branch, token):
+        # 与本地保存一致按内容哈希命名，同一张图片只在仓库中保存一份
+        unique_filename = f"{hashlib.sha256(content_bytes).hexdigest()[:32]}.{ext}"
+        path = f"uploads/{subfolder}/{unique_filename}"
 
-        api_url = f"https://api.github.com/repos/{repo}/contents/{path}"
+        api_base = current_app.config.get('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+        api_url = f"{api_base}/repos/{repo}/contents/{path}"
         headers = {
             "Authorization": f"token {token}",
             "Accept": "application/vnd.github+json"
         }
+        download_url = self._github_existing_url(api_url, headers, branch)
+        if download_url:
+            return download_url
+
+        content_b64 = base64.b64encode(content_bytes).decode('utf-8')
         payload = {
             "message": f"upload {path}",
             "content": content_b64,
             "branch": branch
         }
 
-        resp = requests.put(api_url, json=payload, headers=headers, timeout=20)
+        try:
+            resp = get_github_session().put(api_url, json=payload, headers=headers, timeout=(5, 20))
+        except requests.exceptions.RequestException:
+            # 响应丢失时创建可能已经生效，先确认文件是否已在仓库中
+            download_url = self._github_existing_url(api_url, headers, branch)
+            if download_url:
+                return download_url
+            raise
+        if resp.status_code == 422 or resp.status_code >= 500:
+            # 422 表示文件已存在（例如重试前的请求已成功），5xx 时创建也可能已经生效
+            download_url = self._github_existing_url(api_url, headers, branch)
+            if download_url:
+                return download_url
         if resp.status_code not in (200, 201):
             raise RuntimeError(f"GitHub上传失败: {resp.status_code} {resp.text}")
 
         data = resp.json()
         return data.get('content', {}).get('download_url')
+
+    def _github_existing_url(self, api_url, headers, branch):
+        """查询仓库中已存在的文件，返回 download_url，不存在时返回 None"""
+        resp = get_github_session().get(api_url, headers=headers, params={'ref': branch}, timeout=(5, 20))
+        if resp.status_code != 200:
+            return None
+        return resp.json().get('download_url')
@@ -0,0 +1,99 @@
+from datetime import datetime
+from app.extensions import db
+from app.models import Product, CDKey
+
+# 可售库存：有未售卡密时以 cdkey_stock 计数器为准，否则使用虚拟库存 stock_virtual
+
+def get_available_stock_many(product_ids):
+    """一次查询返回多个商品的可售库存 {product_id: stock}"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+
+    rows = db.session.query(
+        Product.id, Product.cdkey_stock, Product.stock_virtual
+    ).filter(Product.id.in_(product_ids)).all()
+
+    return {
+        product_id: cdkey_stock if cdkey_stock and cdkey_stock > 0 else (stock_virtual or 0)
+        for product_id, cdkey_stock, stock_virtual in rows
+    }
+
+def get_available_stock(product_id):
+    return get_available_stock_many([product_id]).get(product_id, 0)
+
+def adjust_cdkey_stock(product_id, delta):
+    """
+    原子调整未售卡密计数（不提交事务，由调用方与卡密变更一起提交）。
+    卡密商品的 stock_virtual 同步为最新卡密数量。
+    """
+    Product.query.filter_by(id=product_id).update({
+        Product.cdkey_stock: Product.cdkey_stock + delta,
+        Product.stock_virtual: Product.cdkey_stock + delta
+    }, synchronize_session=False)
+
+def recount_cdkey_stock(product_ids=None):
+    """按卡密表重新校准计数器，返回校准的商品数"""
+    unsold_count = db.session.query(db.func.count(CDKey.id)).filter(
+        CDKey.product_id == Product.id,
+        CDKey.status == 'unsold'
+    ).scalar_subquery()
+
+    query = Product.query
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    updated = query.update({Product.cdkey_stock: unsold_count}, synchronize_session=False)
+    db.session.commit()
+    return updated
+
+def _claim_product_cdkeys(order_id, product_id, quantity, now):
+    table = CDKey.__table__
+    dialect = db.session.get_bind().dialect
+    candidates = db.select(table.c.id).where(
+        table.c.product_id == product_id,
+        table.c.status == 'unsold'
+    ).order_by(table.c.id).limit(quantity)
+    if dialect.name == 'postgresql':
+        # 并发领取时跳过已被其他事务锁住的卡密，而不是排队等待
+        candidates = candidates.with_for_update(skip_locked=True)
+    values = {'status': 'sold', 'sold_at': now, 'order_id': order_id}
+
+    if dialect.update_returning and dialect.name in ('sqlite', 'postgresql'):
+        # 单条语句完成“挑选 + 标记已售”，外层再校验一次 status，保证同一卡密不会被发给两个订单
+        return list(db.session.execute(
+            db.update(table)
+            .where(table.c.id.in_(candidates.scalar_subquery()), table.c.status == 'unsold')
+            .values(**values)
+            .returning(table.c.key)
+        ).scalars())
+
+    # 其他数据库：先锁定候选行，再按 id 更新并取回卡密
+    ids = list(db.session.execute(candidates.with_for_update()).scalars())
+    if not ids:
+        return []
+    db.session.execute(
+        db.update(table).where(table.c.id.in_(ids), table.c.status == 'unsold').values(**values)
+    )
+    return list(db.session.execute(
+        db.select(table.c.key).where(table.c.id.in_(ids), table.c.order_id == order_id)
+    ).scalars())
+
+def claim_cdkeys(order_id, lines):
+    """
+    为订单原子领取卡密并扣减计数（不提交事务，由调用方与订单状态一起提交）。
+    lines 为 [(product_id, quantity), ...]，返回 {product_id: [卡密, ...]}；
+    某商品卡密不足时只领取到现有数量，调用方可据此决定回滚。
+    """
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    now = datetime.utcnow()
+    claimed = {}
+    # 按商品 id 顺序领取，多个事务同时领取时加锁顺序一致
+    for product_id in sorted(quantities):
+        keys = _claim_product_cdkeys(order_id, product_id, quantities[product_id], now)
+        if keys:
+            adjust_cdkey_stock(product_id, -len(keys))
+        claimed[product_id] = keys
+    return claimed
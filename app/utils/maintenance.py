@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from app.extensions import db
+from app.models import DiscountCode, FulfillmentJob, Order_Core
+
+# 定时任务：每个函数返回处理的行数，由 Scheduler 记录
+
+def settle_earnings():
+    """结算到期的邀请收益"""
+    from app.utils.aff_calculator import AffiliateCalculator
+
+    calculator = AffiliateCalculator(current_app.config['AFF_COMMISSION_RATE'])
+    result = calculator.settle_earnings(current_app.config['SETTLEMENT_PERIOD'])
+    # 其他进程（例如管理员手动结算）正在推进同一批次
+    return result['records'] if result else 0
+
+def expire_unpaid_orders(chunk_size=200):
+    """关闭超时未支付的订单，并归还其占用的折扣码次数"""
+    from app.utils.order_rollup import change_order_status
+    from app.utils.dashboard_stats import invalidate_dashboard_stats
+    from app.utils.order_state_manager import OrderStateManager
+
+    config = current_app.config
+    cutoff = datetime.utcnow() - timedelta(minutes=config['ORDER_PAYMENT_TIMEOUT_MINUTES'])
+    state_manager = OrderStateManager(
+        config['ORDER_STATE_DATA_DIR'],
+        config['ORDER_STATE_BACKEND'],
+        cache_size=0,
+        fsync=config['ORDER_STATE_FSYNC']
+    )
+
+    expired = 0
+    last_id = 0
+    while True:
+        orders = Order_Core.query.filter(
+            Order_Core.cached_status == 'pending_payment',
+            Order_Core.created_at < cutoff,
+            Order_Core.id > last_id
+        ).order_by(Order_Core.id).limit(chunk_size).all()
+        if not orders:
+            break
+        last_id = orders[-1].id
+
+        with state_manager.batch():
+            for order in orders:
+                # 条件更新，避免与同时到达的支付请求冲突
+                closed = Order_Core.query.filter_by(id=order.id, cached_status='pending_payment').update(
+                    {Order_Core.cached_status: 'rejected'}, synchronize_session=False
+                )
+                if not closed:
+                    continue
+                change_order_status(order, 'rejected')
+                if order.discount_code_id:
+                    DiscountCode.query.filter(
+                        DiscountCode.id == order.discount_code_id,
+                        DiscountCode.used_count > 0
+                    ).update({DiscountCode.used_count: DiscountCode.used_count - 1}, synchronize_session=False)
+                state_manager.update_state(order.id, 'rejected', '超时未支付，订单已自动关闭')
+                expired += 1
+        db.session.commit()
+
+    if expired:
+        invalidate_dashboard_stats()
+    return expired
+
+def recount_cdkey_stock():
+    """按卡密表校准商品的未售卡密计数"""
+    from app.utils.inventory import recount_cdkey_stock as recount
+
+    return recount()
+
+def purge_finished_jobs():
+    """清理保留期之前已结束的发货任务与图片任务"""
+    from app.utils.image_jobs import image_jobs
+
+    retention = timedelta(days=current_app.config['FINISHED_JOB_RETENTION_DAYS'])
+    purged = FulfillmentJob.query.filter(
+        FulfillmentJob.status.in_(['done', 'skipped']),
+        FulfillmentJob.updated_at < datetime.utcnow() - retention
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return purged + image_jobs.purge_finished(retention.total_seconds())
+
+def resume_cdkey_imports():
+    """续跑进程退出后中断的卡密导入任务"""
+    from app.utils.cdkey_import import resume_stale_imports
+
+    return resume_stale_imports()
+
+def register_jobs(scheduler):
+    scheduler.register('settle_earnings', settle_earnings)
+    scheduler.register('expire_unpaid_orders', expire_unpaid_orders)
+    scheduler.register('recount_cdkey_stock', recount_cdkey_stock)
+    scheduler.register('purge_finished_jobs', purge_finished_jobs)
+    scheduler.register('resume_cdkey_imports', resume_cdkey_imports)
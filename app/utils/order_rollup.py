@@ -0,0 +1,128 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert as sql_insert
+from app.extensions import db
+from app.models import OrderDailyRollup, Order_Core, User
+from app.utils.sql_helpers import dialect_insert
+
+ALL_STATUS = '*'
+PAID_STATUSES = ('user_paid', 'shipped', 'completed')
+
+# 订单按下单日期归入日汇总；状态变化时把该单从旧状态行移到新状态行。
+# 以下写入函数都不提交事务，由调用方与订单变更一起提交。
+
+def _bump(day, status, order_count=0, amount=0.0, new_users=0):
+    insert = dialect_insert()
+    if insert is not None:
+        table = OrderDailyRollup.__table__
+        stmt = insert(table).values(
+            day=day,
+            status=status,
+            order_count=order_count,
+            amount=amount,
+            new_users=new_users
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.status],
+            set_={
+                'order_count': table.c.order_count + stmt.excluded.order_count,
+                'amount': table.c.amount + stmt.excluded.amount,
+                'new_users': table.c.new_users + stmt.excluded.new_users
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    updated = OrderDailyRollup.query.filter_by(day=day, status=status).update({
+        OrderDailyRollup.order_count: OrderDailyRollup.order_count + order_count,
+        OrderDailyRollup.amount: OrderDailyRollup.amount + amount,
+        OrderDailyRollup.new_users: OrderDailyRollup.new_users + new_users
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(OrderDailyRollup(
+            day=day, status=status, order_count=order_count, amount=amount, new_users=new_users
+        ))
+
+def _order_day(order):
+    return (order.created_at or datetime.utcnow()).date()
+
+def record_order_created(order):
+    day = _order_day(order)
+    status = order.cached_status or 'pending_payment'
+    _bump(day, ALL_STATUS, 1, order.final_amount)
+    _bump(day, status, 1, order.final_amount)
+
+def record_user_created(user):
+    _bump((user.created_at or datetime.utcnow()).date(), ALL_STATUS, new_users=1)
+
+def change_order_status(order, new_status):
+    """修改订单的 cached_status 并同步日汇总"""
+    old_status = order.cached_status
+    order.cached_status = new_status
+    if old_status == new_status:
+        return
+
+    day = _order_day(order)
+    if old_status:
+        _bump(day, old_status, -1, -order.final_amount)
+    _bump(day, new_status, 1, order.final_amount)
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+def rebuild_order_rollup():
+    """根据历史订单与用户重建日汇总表，返回写入的行数"""
+    rows = {}
+
+    def row(day, status):
+        key = (day, status)
+        if key not in rows:
+            rows[key] = {'day': day, 'status': status, 'order_count': 0, 'amount': 0.0, 'new_users': 0}
+        return rows[key]
+
+    order_day = db.func.date(Order_Core.created_at)
+    for day, status, count, amount in db.session.query(
+        order_day, Order_Core.cached_status, db.func.count(Order_Core.id), db.func.sum(Order_Core.final_amount)
+    ).group_by(order_day, Order_Core.cached_status):
+        day = _as_date(day)
+        for key in (status or 'pending_payment', ALL_STATUS):
+            target = row(day, key)
+            target['order_count'] += count
+            target['amount'] += amount or 0.0
+
+    user_day = db.func.date(User.created_at)
+    for day, count in db.session.query(user_day, db.func.count(User.id)).group_by(user_day):
+        row(_as_date(day), ALL_STATUS)['new_users'] += count
+
+    OrderDailyRollup.query.delete()
+    if rows:
+        db.session.execute(sql_insert(OrderDailyRollup), list(rows.values()))
+    db.session.commit()
+    return len(rows)
+
+def get_sales_report(start_day, end_day):
+    """按天返回 [start_day, end_day] 区间内的订单数、成交额与新增用户"""
+    days = {}
+    day = start_day
+    while day <= end_day:
+        days[day] = {'date': day.isoformat(), 'orders': 0, 'paid_orders': 0, 'sales': 0.0, 'new_users': 0}
+        day += timedelta(days=1)
+
+    for day, status, order_count, amount, new_users in db.session.query(
+        OrderDailyRollup.day,
+        OrderDailyRollup.status,
+        OrderDailyRollup.order_count,
+        OrderDailyRollup.amount,
+        OrderDailyRollup.new_users
+    ).filter(
+        OrderDailyRollup.day >= start_day,
+        OrderDailyRollup.day <= end_day
+    ):
+        entry = days[day]
+        if status == ALL_STATUS:
+            entry['orders'] = order_count
+            entry['new_users'] = new_users
+        elif status in PAID_STATUSES:
+            entry['paid_orders'] += order_count
+            entry['sales'] += amount
+
+    return list(days.values())
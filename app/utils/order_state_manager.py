@@ -1,73 +1,550 @@
+import copy
 import os
+import re
 import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager, ExitStack
 from datetime import datetime
 
-class OrderStateManager:
-    def __init__(self, data_dir):
+try:
+    import fcntl
+except ImportError:
+    # Windows 下没有 fcntl，退化为仅进程内加锁
+    fcntl = None
+
+LOCK_STRIPES = 256
+FSYNC_MODES = ('always', 'batch', 'never')
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程排他锁：进程内用线程锁互斥，进程间用 fcntl.flock"""
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(path, threading.Lock())
+
+    with thread_lock:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # 关闭文件描述符即释放 flock
+            os.close(fd)
+
+
+def apply_event(state, event):
+    """将一条状态事件应用到订单状态上"""
+    event_type = event.get('type')
+    if event_type == 'snapshot':
+        # 深拷贝：后续事件会修改 history 等嵌套结构，不能与事件本身共享
+        return copy.deepcopy(event['state'])
+
+    if state is None:
+        return None
+
+    if event_type == 'status':
+        state['status'] = event['status']
+        state.setdefault('history', []).append({
+            "status": event['status'],
+            "timestamp": event['timestamp'],
+            "message": event['message']
+        })
+    elif event_type == 'cdkey':
+        state['assigned_cdkey'] = event['cdkeys']
+
+    return state
+
+
+class StateBackend:
+    """
+    订单状态存储后端基类。
+    负责按订单加锁、fsync 策略以及组提交（batch 内的多次变更合并为一次落盘）。
+    子类实现 _load(order_id) 与 _commit(events, group)。
+    """
+
+    def __init__(self, data_dir, fsync='batch', fsync_batch_size=32):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"未知的fsync模式: {fsync}")
         self.data_dir = data_dir
-        os.makedirs(self.data_dir, exist_ok=True)
-    
+        self.fsync = fsync
+        self.fsync_batch_size = fsync_batch_size
+        self.lock_dir = os.path.join(data_dir, 'locks')
+        self._unsynced = 0
+        self._local = threading.local()
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _order_lock_path(self, order_id):
+        # 按订单号分片加锁，避免每个订单各建一个锁文件
+        return os.path.join(self.lock_dir, f"order_{int(order_id) % LOCK_STRIPES:03d}.lock")
+
+    @contextmanager
+    def lock_orders(self, order_ids):
+        # 去重并排序后依次加锁，避免同一分片重复加锁及多进程间死锁
+        paths = sorted({self._order_lock_path(order_id) for order_id in order_ids})
+        with ExitStack() as stack:
+            for path in paths:
+                stack.enter_context(file_lock(path))
+            yield
+
+    def _should_fsync(self, count, group):
+        if self.fsync == 'never':
+            return False
+        if self.fsync == 'batch' and not group:
+            self._unsynced += count
+            if self._unsynced < self.fsync_batch_size:
+                return False
+        self._unsynced = 0
+        return True
+
+    def _pending(self):
+        return getattr(self._local, 'pending', None)
+
+    def in_batch(self):
+        return self._pending() is not None
+
+    @contextmanager
+    def batch(self):
+        """组提交：上下文内的状态变更先缓存在内存，退出时一次性加锁写入并 fsync"""
+        if self._pending() is not None:
+            yield
+            return
+
+        self._local.pending = []
+        try:
+            yield
+            pending = self._local.pending
+        finally:
+            self._local.pending = None
+
+        if pending:
+            self._commit(pending, group=True)
+
+    def load(self, order_id):
+        state = self._load(order_id)
+        for pending_order_id, event in self._pending() or []:
+            if pending_order_id == order_id:
+                state = apply_event(state, event)
+        return state
+
+    def append(self, order_id, event):
+        pending = self._pending()
+        if pending is None:
+            return self._commit([(order_id, event)], group=False).get(order_id)
+
+        state = apply_event(self.load(order_id), event)
+        if state is not None:
+            pending.append((order_id, event))
+        return state
+
+    def _group_by_order(self, events):
+        order_ids = []
+        for order_id, _ in events:
+            if order_id not in order_ids:
+                order_ids.append(order_id)
+        return order_ids
+
+
+class JsonFileBackend(StateBackend):
+    """旧版存储：每个订单一个JSON文件，变更时整体重写（临时文件 + 原子rename）"""
+
     def get_order_state_file(self, order_id):
         return os.path.join(self.data_dir, f"order_{order_id}.json")
-    
-    def create_initial_state(self, order_id, user_id, items, customer=None, order_no=None):
-        state = {
-            "order_id": order_id,
-            "order_no": order_no,
-            "user_id": user_id,
-            "status": "pending_payment",
-            "items": items,
-            "customer": customer or {},
-            "created_at": datetime.utcnow().isoformat(),
-            "history": [{
-                "status": "pending_payment",
-                "timestamp": datetime.utcnow().isoformat(),
-                "message": "订单创建"
-            }],
-            "assigned_cdkey": None
-        }
-        
-        with open(self.get_order_state_file(order_id), 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
-        
-        return state
-    
-    def get_order_state(self, order_id):
+
+    def has_order(self, order_id):
+        return os.path.exists(self.get_order_state_file(order_id))
+
+    def version(self, order_id):
+        # 原子rename每次都会产生新inode，配合mtime/size可可靠判断文件是否变化
+        try:
+            st = os.stat(self.get_order_state_file(order_id))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self, order_id):
         file_path = self.get_order_state_file(order_id)
         if not os.path.exists(file_path):
             return None
-        
+
         with open(file_path, 'r', encoding='utf-8') as f:
             return json.load(f)
-    
-    def update_state(self, order_id, new_status, message=None):
-        state = self.get_order_state(order_id)
-        if not state:
+
+    def _write_atomic(self, order_id, state):
+        file_path = self.get_order_state_file(order_id)
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+                f.flush()
+                # rename 之前必须落盘，否则崩溃后可能得到空文件
+                if self.fsync != 'never':
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _sync_dir(self):
+        if os.name != 'posix':
+            return
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _commit(self, events, group):
+        order_ids = self._group_by_order(events)
+        with self.lock_orders(order_ids):
+            # 加锁后重新读取磁盘上的最新状态，再回放本次的事件，避免并发丢失更新
+            states = {order_id: self._load(order_id) for order_id in order_ids}
+            for order_id, event in events:
+                states[order_id] = apply_event(states[order_id], event)
+
+            written = 0
+            for order_id, state in states.items():
+                if state is not None:
+                    self._write_atomic(order_id, state)
+                    written += 1
+
+            # 同一目录下多次 rename 只需一次目录 fsync
+            if written and self._should_fsync(written, group):
+                self._sync_dir()
+
+        return states
+
+
+class EventLogBackend(StateBackend):
+    """
+    追加写的分段事件日志。
+    每次状态变更只追加一行事件到当前段文件，按订单记录 (段号, 偏移, 长度) 索引，
+    读取时按索引定位并回放该订单的事件。
+    """
+
+    SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+    SEGMENT_PATTERN = re.compile(r'^segment_(\d+)\.log$')
+
+    def __init__(self, data_dir, segment_max_bytes=None, **kwargs):
+        super().__init__(data_dir, **kwargs)
+        self.log_dir = os.path.join(data_dir, 'events')
+        self.segment_max_bytes = segment_max_bytes or self.SEGMENT_MAX_BYTES
+        self.index_path = os.path.join(self.log_dir, 'index.db')
+        self.append_lock_path = os.path.join(self.log_dir, 'append.lock')
+        self.legacy = JsonFileBackend(data_dir, fsync=self.fsync)
+        self._active_segment = None
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._init_index()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        # 索引的持久性跟随段文件的 fsync 策略，避免每次提交都额外 fsync
+        synchronous = {'always': 'FULL', 'batch': 'NORMAL', 'never': 'OFF'}[self.fsync]
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+        return conn
+
+    def _index(self):
+        """本线程复用的索引连接（fork 后的子进程重新连接），读缓存命中时不再每次建立连接"""
+        local = self._local
+        if getattr(local, 'index_pid', None) != os.getpid():
+            local.index_conn = self._connect()
+            local.index_pid = os.getpid()
+        return local.index_conn
+
+    def _query(self, sql, params):
+        # fetchall 取完结果后语句即结束，长连接不会一直持有旧的读快照
+        return self._index().execute(sql, params).fetchall()
+
+    def _init_index(self):
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS event_index ("
+                "order_id INTEGER NOT NULL, segment INTEGER NOT NULL, "
+                "offset INTEGER NOT NULL, length INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_event_index_order ON event_index (order_id)")
+            conn.commit()
+
+    def segment_path(self, segment):
+        return os.path.join(self.log_dir, f"segment_{segment:06d}.log")
+
+    def _current_segment(self):
+        if self._active_segment is None:
+            segments = [
+                int(match.group(1))
+                for match in (self.SEGMENT_PATTERN.match(name) for name in os.listdir(self.log_dir))
+                if match
+            ]
+            self._active_segment = max(segments) if segments else 1
+
+        path = self.segment_path(self._active_segment)
+        while os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+            self._active_segment += 1
+            path = self.segment_path(self._active_segment)
+        return self._active_segment
+
+    def _index_entries(self, order_id):
+        return self._query(
+            "SELECT segment, offset, length FROM event_index WHERE order_id = ? ORDER BY rowid",
+            (order_id,)
+        )
+
+    def has_order(self, order_id):
+        return bool(self._query("SELECT 1 FROM event_index WHERE order_id = ? LIMIT 1", (order_id,)))
+
+    def version(self, order_id):
+        # 事件只追加不修改，最后一条事件的rowid即可作为版本号
+        row = self._query("SELECT MAX(rowid) FROM event_index WHERE order_id = ?", (order_id,))[0]
+        if row[0] is None:
+            legacy_version = self.legacy.version(order_id)
+            return ('legacy',) + legacy_version if legacy_version else None
+        return row[0]
+
+    def _read_events(self, entries):
+        events = []
+        handles = {}
+        try:
+            for segment, offset, length in entries:
+                handle = handles.get(segment)
+                if handle is None:
+                    handle = handles[segment] = open(self.segment_path(segment), 'rb')
+                handle.seek(offset)
+                try:
+                    events.append(json.loads(handle.read(length).decode('utf-8')))
+                except ValueError:
+                    # 断电时尚未 fsync 的尾部事件可能不完整，跳过
+                    continue
+        finally:
+            for handle in handles.values():
+                handle.close()
+        return events
+
+    def _load(self, order_id):
+        entries = self._index_entries(order_id)
+        if not entries:
+            # 尚未迁移的旧订单，直接读取原JSON文件
+            return self.legacy.load(order_id)
+
+        state = None
+        for event in self._read_events(entries):
+            state = apply_event(state, event)
+        return state
+
+    def _write_events(self, records, group):
+        lines = [
+            (order_id, (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+            for order_id, event in records
+        ]
+
+        with file_lock(self.append_lock_path):
+            segment = self._current_segment()
+            with open(self.segment_path(segment), 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(b''.join(line for _, line in lines))
+                f.flush()
+                if self._should_fsync(len(lines), group):
+                    os.fsync(f.fileno())
+
+            rows = []
+            for order_id, line in lines:
+                rows.append((order_id, segment, offset, len(line)))
+                offset += len(line)
+
+            # 段文件写入成功后再提交索引，索引永远不会指向未写出的数据
+            conn = self._index()
+            try:
+                conn.executemany(
+                    "INSERT INTO event_index (order_id, segment, offset, length) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def _commit(self, events, group):
+        order_ids = self._group_by_order(events)
+        with self.lock_orders(order_ids):
+            states = {}
+            records = []
+            stale_snapshots = set()
+            for order_id in order_ids:
+                first_event = next(event for pending_id, event in events if pending_id == order_id)
+                if first_event.get('type') == 'snapshot':
+                    if self.has_order(order_id):
+                        # 加锁后复查：订单已有事件（例如迁移旧订单期间被在线写入）时丢弃快照，不能覆盖较新的状态
+                        stale_snapshots.add(order_id)
+                        states[order_id] = self._load(order_id)
+                    else:
+                        states[order_id] = None
+                    continue
+                states[order_id] = self._load(order_id)
+                if states[order_id] is not None and not self.has_order(order_id):
+                    # 旧订单首次变更时先写入一份快照，后续只追加增量事件
+                    # 快照必须在回放本次事件之前复制，否则会带上即将追加的事件而被重复回放
+                    records.append((order_id, {"type": "snapshot", "state": copy.deepcopy(states[order_id])}))
+
+            for order_id, event in events:
+                if order_id in stale_snapshots and event.get('type') == 'snapshot':
+                    continue
+                state = apply_event(states[order_id], event)
+                if state is None:
+                    continue
+                states[order_id] = state
+                records.append((order_id, event))
+
+            if records:
+                self._write_events(records, group)
+
+        return states
+
+
+BACKENDS = {
+    'json': JsonFileBackend,
+    'eventlog': EventLogBackend,
+}
+
+
+def migrate_json_states(data_dir, backend, chunk_size=500):
+    """将旧版 order_{id}.json 目录一次性导入事件日志，返回 (导入数, 跳过数)"""
+    imported = 0
+    skipped = 0
+    pattern = re.compile(r'^order_(\d+)\.json$')
+
+    names = sorted(name for name in os.listdir(data_dir) if pattern.match(name))
+    for start in range(0, len(names), chunk_size):
+        with backend.batch():
+            for name in names[start:start + chunk_size]:
+                order_id = int(pattern.match(name).group(1))
+                if backend.has_order(order_id):
+                    skipped += 1
+                    continue
+
+                try:
+                    with open(os.path.join(data_dir, name), 'r', encoding='utf-8') as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    skipped += 1
+                    continue
+
+                backend.append(order_id, {"type": "snapshot", "state": state})
+                imported += 1
+
+    return imported, skipped
+
+
+class OrderStateManager:
+    def __init__(self, data_dir, backend='eventlog', cache_size=1024, **backend_options):
+        self.data_dir = data_dir
+        os.makedirs(self.data_dir, exist_ok=True)
+        if isinstance(backend, str):
+            backend = BACKENDS[backend](data_dir, **backend_options)
+        self.backend = backend
+
+        # 订单状态读缓存（LRU），以后端版本号校验，兼容多进程写入
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def get_order_state_file(self, order_id):
+        return os.path.join(self.data_dir, f"order_{order_id}.json")
+
+    def batch(self):
+        """
+        组提交上下文，批量发货/批量改状态时使用：
+            with order_state_manager.batch():
+                order_state_manager.assign_cdkey(...)
+                order_state_manager.update_state(...)
+        """
+        return self.backend.batch()
+
+    def create_initial_state(self, order_id, user_id, items, customer=None, order_no=None):
+        state = {
+            "order_id": order_id,
+            "order_no": order_no,
+            "user_id": user_id,
+            "status": "pending_payment",
+            "items": items,
+            "customer": customer or {},
+            "created_at": datetime.utcnow().isoformat(),
+            "history": [{
+                "status": "pending_payment",
+                "timestamp": datetime.utcnow().isoformat(),
+                "message": "订单创建"
+            }],
+            "assigned_cdkey": None
+        }
+
+        self.invalidate(order_id)
+        return self.backend.append(order_id, {"type": "snapshot", "state": state})
+
+    def get_order_state(self, order_id):
+        """读取订单状态；返回的字典为缓存共享对象，调用方不应修改"""
+        if not self.cache_size or self.backend.in_batch():
+            return self.backend.load(order_id)
+
+        version = self.backend.version(order_id)
+        if version is None:
+            self.invalidate(order_id)
             return None
-        
-        state["status"] = new_status
-        state["history"].append({
+
+        with self._cache_lock:
+            entry = self._cache.get(order_id)
+            if entry is not None and entry[0] == version:
+                self._cache.move_to_end(order_id)
+                self.cache_hits += 1
+                return entry[1]
+            self.cache_misses += 1
+
+        state = self.backend.load(order_id)
+        with self._cache_lock:
+            if state is None:
+                self._cache.pop(order_id, None)
+            else:
+                self._cache[order_id] = (version, state)
+                self._cache.move_to_end(order_id)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return state
+
+    def invalidate(self, order_id):
+        with self._cache_lock:
+            self._cache.pop(order_id, None)
+
+    def cache_info(self):
+        """缓存命中统计，用于评估缓存容量"""
+        with self._cache_lock:
+            total = self.cache_hits + self.cache_misses
+            return {
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'hit_rate': self.cache_hits / total if total else 0.0,
+                'size': len(self._cache),
+                'capacity': self.cache_size
+            }
+
+    def update_state(self, order_id, new_status, message=None):
+        self.invalidate(order_id)
+        return self.backend.append(order_id, {
+            "type": "status",
             "status": new_status,
             "timestamp": datetime.utcnow().isoformat(),
             "message": message or f"状态更新为{new_status}"
         })
-        
-        with open(self.get_order_state_file(order_id), 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
-        
-        return state
-    
-    def assign_cdkey(self, order_id, cdkeys):
-        state = self.get_order_state(order_id)
-        if not state:
-            return None
-
-        if isinstance(cdkeys, list):
-            state["assigned_cdkey"] = cdkeys
-        else:
-            state["assigned_cdkey"] = cdkeys
-        
-        with open(self.get_order_state_file(order_id), 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
-        
-        return state
+
+    def assign_cdkey(self, order_id, cdkeys):
+        self.invalidate(order_id)
+        return self.backend.append(order_id, {"type": "cdkey", "cdkeys": cdkeys})
+
+    def migrate_from_json(self):
+        """导入数据目录下的旧版JSON订单状态"""
+        return migrate_json_states(self.data_dir, self.backend)
@@ -1,6 +1,14 @@
+import base64
+import json
+import threading
+import time
+from datetime import datetime
 from flask import request, url_for
+from sqlalchemy import tuple_
 
 class Pagination:
+    is_keyset = False
+
     def __init__(self, page, per_page, total, items):
         self.page = page
         self.per_page = per_page
@@ -51,7 +59,7 @@ class Pagination:
         """获取指定页码的URL"""
         args = request.args.copy()
         args['page'] = page
-        return url_for(request.endpoint, **args)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
 
 
 def paginate(query, page=None, per_page=None, error_out=True):
@@ -68,4 +76,143 @@ def paginate(query, page=None, per_page=None, error_out=True):
     if error_out and page < 1:
         page = 1
     
-    return Pagination(page, per_page, total, items)
\ No newline at end of file
+    return Pagination(page, per_page, total, items)
+
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+def cached_count(query, ttl=60):
+    """带TTL缓存的 count()，键为查询语句及参数"""
+    compiled = query.statement.compile()
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    now = time.monotonic()
+    with _count_cache_lock:
+        entry = _count_cache.get(key)
+        if entry and entry[1] > now:
+            return entry[0]
+
+    total = query.order_by(None).count()
+    with _count_cache_lock:
+        if len(_count_cache) > 1024:
+            _count_cache.clear()
+        _count_cache[key] = (total, now + ttl)
+    return total
+
+
+def clear_count_cache():
+    """清空总数缓存"""
+    with _count_cache_lock:
+        _count_cache.clear()
+
+
+def _encode_cursor(values, direction):
+    payload = []
+    for value in values:
+        if isinstance(value, datetime):
+            payload.append(['dt', value.isoformat()])
+        else:
+            payload.append(['v', value])
+    raw = json.dumps({'d': direction, 'k': payload}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        values = [datetime.fromisoformat(v) if t == 'dt' else v for t, v in data['k']]
+        if data['d'] not in ('next', 'prev'):
+            return None, None
+        return values, data['d']
+    except (ValueError, TypeError, KeyError):
+        return None, None
+
+
+class KeysetPagination:
+    """游标分页：按排序键定位，不使用 OFFSET，翻页代价只与每页条数有关"""
+
+    is_keyset = True
+
+    def __init__(self, per_page, items, order_columns, has_prev, has_next, total=None):
+        self.page = None
+        self.per_page = per_page
+        self.items = items
+        self.total = total
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.order_columns = order_columns
+
+    @property
+    def pages(self):
+        """页数仅供模板判断是否显示翻页导航"""
+        pages = (self.total + self.per_page - 1) // self.per_page if self.total else 0
+        return max(pages, 2 if self.has_prev or self.has_next else 1)
+
+    def _cursor_for(self, item, direction):
+        return _encode_cursor([getattr(item, column.key) for column in self.order_columns], direction)
+
+    def prev(self, error_out=False):
+        """上一页的游标"""
+        if not self.has_prev or not self.items:
+            return None
+        return self._cursor_for(self.items[0], 'prev')
+
+    def next(self, error_out=False):
+        """下一页的游标"""
+        if not self.has_next or not self.items:
+            return None
+        return self._cursor_for(self.items[-1], 'next')
+
+    def iter_pages(self, *args, **kwargs):
+        """游标分页没有页码"""
+        return iter(())
+
+    def get_url(self, cursor):
+        """获取指定游标的URL"""
+        args = request.args.copy()
+        args.pop('page', None)
+        args['cursor'] = cursor
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def keyset_paginate(query, order_columns, cursor=None, per_page=None, count='cached', count_ttl=60):
+    """
+    游标分页查询，按 order_columns 倒序（最后一列须唯一，如 id）。
+    query 不应自带 order_by；count 可选 'exact' / 'cached' / None（不统计总数）。
+    """
+    if cursor is None:
+        cursor = request.args.get('cursor')
+
+    if per_page is None:
+        per_page = request.args.get('per_page', 20, type=int)
+
+    values, direction = _decode_cursor(cursor) if cursor else (None, None)
+    if values is not None and len(values) != len(order_columns):
+        values, direction = None, None
+
+    total = None
+    if count == 'exact':
+        total = query.order_by(None).count()
+    elif count == 'cached':
+        total = cached_count(query, count_ttl)
+
+    key = tuple_(*order_columns)
+    if direction == 'prev':
+        rows = query.filter(key > tuple_(*values)).order_by(
+            *[column.asc() for column in order_columns]
+        ).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if values is not None:
+            query = query.filter(key < tuple_(*values))
+        rows = query.order_by(
+            *[column.desc() for column in order_columns]
+        ).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = values is not None
+
+    return KeysetPagination(per_page, items, order_columns, has_prev, has_next, total)
@@ -0,0 +1,46 @@
+from app.extensions import db
+from app.models import Product, ProductTag
+
+def parse_tags(text):
+    """拆分逗号分隔的标签字符串：去空白、去空项、去重并保持顺序"""
+    tags = []
+    for tag in (text or '').replace('，', ',').split(','):
+        tag = tag.strip()[:50]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+def sync_product_tags(product):
+    """按 product.tags 重写该商品的标签关联（不提交事务）"""
+    ProductTag.query.filter_by(product_id=product.id).delete(synchronize_session=False)
+    rows = [{'product_id': product.id, 'tag': tag} for tag in parse_tags(product.tags)]
+    if rows:
+        db.session.execute(ProductTag.__table__.insert(), rows)
+
+def rebuild_product_tags():
+    """根据所有商品的 tags 字段重建 product_tag 表，返回写入行数"""
+    ProductTag.query.delete(synchronize_session=False)
+    rows = []
+    for product_id, tags in db.session.query(Product.id, Product.tags):
+        rows.extend({'product_id': product_id, 'tag': tag} for tag in parse_tags(tags))
+    if rows:
+        db.session.execute(ProductTag.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+def filter_by_tags(query, tags):
+    """筛选同时带有全部指定标签（逗号分隔）的商品，走 ix_product_tag_tag 索引求交集"""
+    tags = parse_tags(tags)
+    if not tags:
+        return query
+    matched = db.session.query(ProductTag.product_id).filter(
+        ProductTag.tag.in_(tags)
+    ).group_by(ProductTag.product_id).having(db.func.count(ProductTag.tag) == len(tags))
+    return query.filter(Product.id.in_(matched))
+
+def get_tag_counts():
+    """上架商品的标签及商品数，按数量降序"""
+    count = db.func.count(ProductTag.product_id)
+    return db.session.query(ProductTag.tag, count).join(
+        Product, Product.id == ProductTag.product_id
+    ).filter(Product.is_active == True).group_by(ProductTag.tag).order_by(count.desc(), ProductTag.tag).all()
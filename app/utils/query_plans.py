@@ -0,0 +1,25 @@
+from sqlalchemy import text
+
+# 热点查询，用于 check-query-plans 与测试检查索引命中情况
+HOT_QUERIES = [
+    ('商品未售卡密', "SELECT id FROM cdkey WHERE product_id = 1 AND status = 'unsold' LIMIT 10"),
+    ('用户购物车', "SELECT quantity FROM cart WHERE user_id = 1"),
+    ('用户订单列表', "SELECT id FROM order_core WHERE user_id = 1 ORDER BY created_at DESC LIMIT 10"),
+    ('按状态订单列表', "SELECT id FROM order_core WHERE cached_status = 'user_paid' ORDER BY created_at DESC LIMIT 20"),
+    ('全部订单列表', "SELECT id FROM order_core ORDER BY created_at DESC LIMIT 20"),
+    ('待结算收益', "SELECT id FROM earning_record WHERE status = 'pending' AND created_at <= '2000-01-01'"),
+    ('用户收益列表', "SELECT id FROM earning_record WHERE user_id = 1 ORDER BY created_at DESC LIMIT 20"),
+    ('被邀请人关系', "SELECT inviter_id FROM invite_relation WHERE invitee_id = 1"),
+    ('邀请人关系', "SELECT invitee_id FROM invite_relation WHERE inviter_id = 1"),
+    ('热门商品', "SELECT id FROM product WHERE is_active = 1 ORDER BY sold_count DESC LIMIT 4"),
+    ('最新商品', "SELECT id FROM product WHERE is_active = 1 ORDER BY created_at DESC LIMIT 4"),
+]
+
+def explain_query(session, sql):
+    """返回 (是否命中索引, 查询计划各行)；全表扫描或为排序额外建临时B树都视为未命中（仅SQLite）"""
+    plan = [row[-1] for row in session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()]
+    uses_index = not any(
+        (detail.startswith('SCAN') and 'USING' not in detail) or 'TEMP B-TREE' in detail
+        for detail in plan
+    )
+    return uses_index, plan
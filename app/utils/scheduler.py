@@ -0,0 +1,228 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from app.extensions import db
+from app.models import ScheduledJob
+from app.utils.sql_helpers import dialect_insert
+
+def _parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f'cron 字段超出范围: {field}')
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """五段式 cron 表达式（分 时 日 月 周），支持 * , - /，按服务器本地时间计算"""
+
+    def __init__(self, expr):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f'cron 表达式需要5段: {expr}')
+        self.expr = expr
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        # 周日可以写 0 或 7
+        self.weekdays = {day % 7 for day in _parse_cron_field(fields[4], 0, 7)}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        # 与标准 cron 一致：日和周都有限定时满足其一即可
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, after):
+        """返回 after 之后第一个匹配的时间（精确到分钟）"""
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f'cron 表达式没有可执行时间: {self.expr}')
+
+class Scheduler:
+    """
+    应用内定时任务：每个进程一个调度线程，到期任务通过 scheduled_job 表上的租约抢占，
+    多个 gunicorn worker（或多台机器）同时运行时每次只有一个进程执行。
+    任务函数返回处理的行数，执行耗时与行数记录在 scheduled_job 中。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.jobs = {}
+        self._pid = None
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('SCHEDULER_ENABLED', True)
+        self.tick = app.config.get('SCHEDULER_TICK', 30)
+        self.lease_seconds = app.config.get('SCHEDULER_LEASE_SECONDS', 900)
+        app.extensions['scheduler'] = self
+        app.before_request(self.ensure_started)
+
+    def register(self, name, func):
+        """登记任务；执行计划取自 SCHEDULED_JOBS[name]：整数为间隔秒数，字符串为 cron 表达式，None 表示停用"""
+        self.jobs[name] = func
+
+    def schedule_for(self, name):
+        return self.app.config.get('SCHEDULED_JOBS', {}).get(name)
+
+    def _next_run(self, schedule, now):
+        if isinstance(schedule, (int, float)):
+            return now + timedelta(seconds=schedule)
+        # cron 按本地时间解释，存库统一用 UTC
+        offset = timedelta(minutes=round((datetime.now() - datetime.utcnow()).total_seconds() / 60))
+        return CronSchedule(schedule).next_after(now + offset) - offset
+
+    def _owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    def ensure_started(self):
+        """按进程启动调度线程（fork 后的子进程会重新启动）"""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"定时任务调度出错: {e}")
+            time.sleep(self.tick)
+
+    def sync_jobs(self, now=None):
+        """为新任务建行；执行计划在配置中修改后重新计算下次执行时间"""
+        now = now or datetime.utcnow()
+        table = ScheduledJob.__table__
+        existing = {job.name: job for job in ScheduledJob.query.all()}
+        for name in self.jobs:
+            schedule = self.schedule_for(name)
+            if schedule is None:
+                continue
+            schedule_text = str(schedule)
+            job = existing.get(name)
+            if job is None:
+                values = {'name': name, 'schedule': schedule_text, 'next_run_at': self._next_run(schedule, now), 'run_count': 0}
+                insert = dialect_insert()
+                if insert is not None:
+                    db.session.execute(insert(table).values(**values).on_conflict_do_nothing(index_elements=[table.c.name]))
+                else:
+                    db.session.add(ScheduledJob(**values))
+            elif job.schedule != schedule_text:
+                job.schedule = schedule_text
+                job.next_run_at = self._next_run(schedule, now)
+        db.session.commit()
+
+    def _acquire(self, name, now, force=False):
+        """抢占任务租约；未到期、停用或被其他进程持有时返回 None"""
+        owner = self._owner()
+        conditions = [
+            ScheduledJob.name == name,
+            db.or_(ScheduledJob.lease_until.is_(None), ScheduledJob.lease_until < now)
+        ]
+        if not force:
+            conditions.append(ScheduledJob.next_run_at <= now)
+        acquired = ScheduledJob.query.filter(*conditions).update({
+            ScheduledJob.lease_owner: owner,
+            ScheduledJob.lease_until: now + timedelta(seconds=self.lease_seconds),
+            ScheduledJob.last_started_at: now
+        }, synchronize_session=False)
+        db.session.commit()
+        return owner if acquired else None
+
+    def _execute(self, name, owner):
+        started = time.monotonic()
+        rows, status, error = 0, 'ok', None
+        try:
+            rows = self.jobs[name]() or 0
+        except Exception as e:
+            db.session.rollback()
+            status, error = 'failed', str(e)[:1000]
+            print(f"定时任务 {name} 执行失败: {e}")
+        duration = time.monotonic() - started
+
+        now = datetime.utcnow()
+        schedule = self.schedule_for(name)
+        values = {
+            ScheduledJob.lease_owner: None,
+            ScheduledJob.lease_until: None,
+            ScheduledJob.last_finished_at: now,
+            ScheduledJob.last_duration: duration,
+            ScheduledJob.last_rows: rows,
+            ScheduledJob.last_status: status,
+            ScheduledJob.last_error: error,
+            ScheduledJob.run_count: ScheduledJob.run_count + 1
+        }
+        if schedule is not None:
+            values[ScheduledJob.next_run_at] = self._next_run(schedule, now)
+        ScheduledJob.query.filter_by(name=name, lease_owner=owner).update(values, synchronize_session=False)
+        db.session.commit()
+        self.app.logger.info(f"定时任务 {name}: {status}，{rows}行，耗时{duration:.2f}秒")
+        return {'name': name, 'status': status, 'rows': rows, 'duration': duration, 'error': error}
+
+    def run_due(self):
+        """执行本进程抢到的到期任务，返回各任务的执行结果"""
+        results = []
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                self.sync_jobs(now)
+                for name in self.jobs:
+                    if self.schedule_for(name) is None:
+                        continue
+                    owner = self._acquire(name, now)
+                    if owner:
+                        results.append(self._execute(name, owner))
+            finally:
+                db.session.remove()
+        return results
+
+    def run_job(self, name):
+        """立即执行一次任务（仍需抢到租约），其他进程正在执行时返回 None"""
+        if name not in self.jobs:
+            raise KeyError(name)
+        now = datetime.utcnow()
+        self.sync_jobs(now)
+        owner = self._acquire(name, now, force=True)
+        if owner is None:
+            return None
+        return self._execute(name, owner)
+
+scheduler = Scheduler()
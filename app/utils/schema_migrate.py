@@ -10,6 +10,13 @@ def _table_exists(db, table_name):
     ).fetchone()
     return result is not None
 
+def _index_exists(db, index_name):
+    result = db.session.execute(
+        text("SELECT name FROM sqlite_master WHERE type='index' AND name=:name"),
+        {"name": index_name},
+    ).fetchone()
+    return result is not None
+
 def _get_columns(db, table_name):
     rows = db.session.execute(text(f"PRAGMA table_info({table_name})")).fetchall()
     return {row[1] for row in rows}
@@ -17,6 +24,15 @@ def _get_columns(db, table_name):
 def _add_column(db, table_name, column_def):
     db.session.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_def}"))
 
+def _ensure_indexes(db):
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        if not _table_exists(db, table.name):
+            continue
+        for index in table.indexes:
+            if not _index_exists(db, index.name):
+                index.create(bind=connection)
+
 def ensure_sqlite_schema(db):
     """
     启动时自动检查并修复SQLite缺失列/表。
@@ -25,6 +41,9 @@ def ensure_sqlite_schema(db):
     if not _is_sqlite(db):
         return
 
+    rollup_missing = not _table_exists(db, 'order_daily_rollup')
+    product_tag_missing = not _table_exists(db, 'product_tag')
+
     # 先创建缺失表（不会影响已有表）
     db.create_all()
 
@@ -38,7 +57,7 @@ def ensure_sqlite_schema(db):
                 "UPDATE discount_code SET created_at = COALESCE(valid_from, CURRENT_TIMESTAMP)"
             ))
 
-    # 修复订单表缺失 order_no
+    # 修复订单表缺失 order_no / payment_confirmed_at
     if _table_exists(db, 'order_core'):
         columns = _get_columns(db, 'order_core')
         if 'order_no' not in columns:
@@ -46,6 +65,52 @@ def ensure_sqlite_schema(db):
             db.session.execute(text(
                 "UPDATE order_core SET order_no = printf('%06d', id) WHERE order_no IS NULL OR order_no = ''"
             ))
+        if 'payment_confirmed_at' not in columns:
+            _add_column(db, 'order_core', 'payment_confirmed_at DATETIME')
+
+    # 商品未售卡密计数器，按现有卡密回填
+    if _table_exists(db, 'product'):
+        columns = _get_columns(db, 'product')
+        if 'cdkey_stock' not in columns:
+            _add_column(db, 'product', 'cdkey_stock INTEGER NOT NULL DEFAULT 0')
+            db.session.execute(text(
+                "UPDATE product SET cdkey_stock = ("
+                "SELECT COUNT(*) FROM cdkey WHERE cdkey.product_id = product.id AND cdkey.status = 'unsold')"
+            ))
+
+    # 卡密去重哈希列；回填时同一商品下重复的卡密只保留最早一条的哈希，唯一索引随后由 _ensure_indexes 创建
+    if _table_exists(db, 'cdkey'):
+        columns = _get_columns(db, 'cdkey')
+        if 'key_hash' not in columns:
+            _add_column(db, 'cdkey', 'key_hash VARCHAR(32)')
+            from app.utils.cdkey_import import backfill_key_hashes
+            backfill_key_hashes()
+
+    # 卡密导入任务的心跳列
+    if _table_exists(db, 'cdkey_import'):
+        columns = _get_columns(db, 'cdkey_import')
+        if 'updated_at' not in columns:
+            _add_column(db, 'cdkey_import', 'updated_at DATETIME')
+
+    # 结算批次的租约列
+    if _table_exists(db, 'settlement_run'):
+        columns = _get_columns(db, 'settlement_run')
+        if 'lease_owner' not in columns:
+            _add_column(db, 'settlement_run', 'lease_owner VARCHAR(200)')
+        if 'lease_until' not in columns:
+            _add_column(db, 'settlement_run', 'lease_until DATETIME')
+
+    # 购物车 (user_id, product_id) 唯一索引创建前先合并历史重复行
+    if _table_exists(db, 'cart') and not _index_exists(db, 'uq_cart_user_product'):
+        db.session.execute(text(
+            "UPDATE cart SET quantity = ("
+            "SELECT SUM(c2.quantity) FROM cart c2 "
+            "WHERE c2.user_id = cart.user_id AND c2.product_id = cart.product_id"
+            ") WHERE id IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id HAVING COUNT(*) > 1)"
+        ))
+        db.session.execute(text(
+            "DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id)"
+        ))
 
     # 修复站点设置表缺失字段（早期版本可能无此表或列）
     if _table_exists(db, 'site_setting'):
@@ -70,4 +135,21 @@ def ensure_sqlite_schema(db):
             if col not in columns:
                 _add_column(db, 'site_setting', col_def)
 
+    # 为已有表补建模型中声明的索引
+    _ensure_indexes(db)
+
     db.session.commit()
+
+    # 首次升级时根据历史订单回填日汇总表
+    if rollup_missing:
+        from app.utils.order_rollup import rebuild_order_rollup
+        rebuild_order_rollup()
+
+    # 首次升级时根据商品 tags 字段回填标签关联表
+    if product_tag_missing:
+        from app.utils.product_tags import rebuild_product_tags
+        rebuild_product_tags()
+
+    # 商品/用户全文索引（FTS5），缺失时创建并回填
+    from app.utils.search_index import ensure_search_indexes
+    ensure_search_indexes()
@@ -0,0 +1,163 @@
+import re
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from app.extensions import db
+from app.models import Product, User
+
+# 全文索引：FTS5 表名 -> (模型, 索引字段, bm25 字段权重)
+SEARCH_INDEXES = {
+    'product_fts': (Product, ('name', 'description', 'category', 'tags'), (10.0, 1.0, 3.0, 5.0)),
+    'user_fts': (User, ('username', 'email', 'display_name'), (5.0, 3.0, 5.0)),
+}
+
+# 英文词按前缀查询，额外建 2~4 字符的前缀索引，短前缀不必展开成成百上千个词项
+_FTS_OPTIONS = "tokenize='unicode61', prefix='2 3 4'"
+
+# 中日韩字符连续段；其余按字母数字切词
+_TOKEN_RE = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)|([^\W_]+)')
+
+# 已建好 FTS5 表的数据库（按连接URL），其余情况走 LIKE 回退
+_ready = set()
+
+def _cjk_run_tokens(run, for_query):
+    if len(run) == 1:
+        return [run]
+    bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+    # 索引中同时保存单字，单字查询也能命中；查询时只用二元组
+    return bigrams if for_query else list(run) + bigrams
+
+def tokenize(value, for_query=False):
+    """中文按单字+相邻二元组切分，其余按单词，结果交给 FTS5 的 unicode61 分词器"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(value or ''):
+        if cjk:
+            tokens.extend(_cjk_run_tokens(cjk, for_query))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+def build_match_query(keywords):
+    """把用户输入转换为 FTS5 MATCH 表达式（各词项 AND，英文词按前缀匹配）"""
+    terms = []
+    for token in tokenize(keywords, for_query=True):
+        term = f'"{token}"'
+        if not _TOKEN_RE.match(token).group(1):
+            term += '*'
+        if term not in terms:
+            terms.append(term)
+    return ' '.join(terms) or None
+
+def _index_key(connection):
+    return str(connection.engine.url)
+
+def search_ready(table_name):
+    return (_index_key(db.session.get_bind()), table_name) in _ready
+
+def _row_values(target, columns):
+    return {column: ' '.join(tokenize(getattr(target, column))) for column in columns}
+
+def _insert_sql(table_name, columns):
+    return text(f"INSERT INTO {table_name} (rowid, {', '.join(columns)}) VALUES (:id, {', '.join(':' + c for c in columns)})")
+
+def _write_row(connection, table_name, columns, target):
+    connection.execute(text(f"DELETE FROM {table_name} WHERE rowid = :id"), {'id': target.id})
+    connection.execute(_insert_sql(table_name, columns), {'id': target.id, **_row_values(target, columns)})
+
+def _register_listeners(table_name, model, columns):
+    def after_insert(mapper, connection, target):
+        if (_index_key(connection), table_name) in _ready:
+            _write_row(connection, table_name, columns, target)
+
+    def after_update(mapper, connection, target):
+        if (_index_key(connection), table_name) not in _ready:
+            return
+        state = db.inspect(target)
+        if any(state.attrs[column].history.has_changes() for column in columns):
+            _write_row(connection, table_name, columns, target)
+
+    def after_delete(mapper, connection, target):
+        if (_index_key(connection), table_name) in _ready:
+            connection.execute(text(f"DELETE FROM {table_name} WHERE rowid = :id"), {'id': target.id})
+
+    event.listen(model, 'after_insert', after_insert)
+    event.listen(model, 'after_update', after_update)
+    event.listen(model, 'after_delete', after_delete)
+
+for _table_name, (_model, _columns, _weights) in SEARCH_INDEXES.items():
+    _register_listeners(_table_name, _model, _columns)
+
+def rebuild_search_index(table_name, chunk_size=1000):
+    """按模型数据重建指定的 FTS5 表，返回索引行数"""
+    model, columns, _ = SEARCH_INDEXES[table_name]
+    connection = db.session.connection()
+    connection.execute(text(f"DELETE FROM {table_name}"))
+    rows = db.session.query(model.id, *[getattr(model, column) for column in columns]).all()
+    for start in range(0, len(rows), chunk_size):
+        connection.execute(_insert_sql(table_name, columns), [
+            {'id': row[0], **{column: ' '.join(tokenize(value)) for column, value in zip(columns, row[1:])}}
+            for row in rows[start:start + chunk_size]
+        ])
+    db.session.commit()
+    return len(rows)
+
+def _create_sql(table_name, columns):
+    return f"CREATE VIRTUAL TABLE {table_name} USING fts5({', '.join(columns)}, {_FTS_OPTIONS})"
+
+def ensure_search_indexes():
+    """SQLite 下创建缺失（或建表选项已过时）的 FTS5 表并回填；不支持 FTS5 时保持 LIKE 回退"""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    key = _index_key(db.session.get_bind())
+    for table_name, (model, columns, _) in SEARCH_INDEXES.items():
+        create_sql = _create_sql(table_name, columns)
+        existing = db.session.execute(
+            text("SELECT sql FROM sqlite_master WHERE type='table' AND name=:name"),
+            {'name': table_name}
+        ).fetchone()
+        if existing and existing[0] != create_sql:
+            db.session.execute(text(f"DROP TABLE {table_name}"))
+            existing = None
+        if not existing:
+            try:
+                db.session.execute(text(create_sql))
+            except OperationalError as e:
+                db.session.rollback()
+                print(f"创建全文索引 {table_name} 失败，搜索将使用LIKE: {e}")
+                continue
+            _ready.add((key, table_name))
+            rebuild_search_index(table_name)
+        else:
+            _ready.add((key, table_name))
+
+def apply_search(query, model, keywords):
+    """
+    为查询加上关键词搜索条件，返回 (query, rank)。
+    有 FTS5 索引时按 bm25 排序（rank 越小越相关），否则回退为各词 LIKE 匹配，rank 为 None。
+    FTS5 只取最新的 SEARCH_CANDIDATE_LIMIT 条匹配作为候选，排序和总数都在候选范围内。
+    """
+    for table_name, (indexed_model, columns, weights) in SEARCH_INDEXES.items():
+        if indexed_model is model:
+            break
+    else:
+        raise ValueError(f'{model.__name__} 没有全文索引')
+
+    if search_ready(table_name):
+        match = build_match_query(keywords)
+        if match is None:
+            return query.filter(db.false()), None
+        matched = db.select(
+            db.literal_column('rowid').label('doc_id'),
+            db.literal_column(f"bm25({table_name}, {', '.join(str(w) for w in weights)})").label('rank')
+        ).select_from(db.table(table_name)).where(
+            db.text(f"{table_name} MATCH :fts_query").bindparams(fts_query=match)
+        ).order_by(
+            # FTS5 按 rowid 顺序读取，带 LIMIT 时 bm25 只对候选行计算，不再给全部命中打分后排序
+            db.literal_column('rowid').desc()
+        ).limit(current_app.config['SEARCH_CANDIDATE_LIMIT']).subquery()
+        return query.join(matched, model.id == matched.c.doc_id), matched.c.rank
+
+    for word in (keywords or '').split():
+        pattern = f'%{word}%'
+        query = query.filter(db.or_(*[getattr(model, column).ilike(pattern) for column in columns]))
+    return query, None
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+import uuid
+from types import SimpleNamespace
+from flask import current_app
+from app.models import SiteSetting
+
+# 进程内的站点设置缓存：{版本戳文件路径: (版本, 设置快照, 快速链接)}
+# 管理员保存设置时替换版本戳文件，其他 worker 发现 inode/mtime 变化后重新加载
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _stamp_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def _write_stamp(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(temp_path, path)
+
+def _load():
+    setting = SiteSetting.get()
+    snapshot = SimpleNamespace(**{
+        column.key: getattr(setting, column.key)
+        for column in SiteSetting.__table__.columns
+    })
+    quick_links = []
+    if snapshot.quick_links:
+        try:
+            quick_links = json.loads(snapshot.quick_links)
+        except (TypeError, ValueError):
+            quick_links = []
+    return snapshot, quick_links
+
+def get_site_settings():
+    """返回 (设置快照, 快速链接列表)，快照只读"""
+    path = current_app.config['SITE_SETTINGS_STAMP_FILE']
+    version = _stamp_version(path)
+    if version is None:
+        _write_stamp(path)
+        version = _stamp_version(path)
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+
+    snapshot, quick_links = _load()
+    with _cache_lock:
+        _cache[path] = (version, snapshot, quick_links)
+    return snapshot, quick_links
+
+def invalidate_site_settings():
+    """设置保存后调用：替换版本戳文件，使所有进程的缓存失效"""
+    from app.utils.storefront_cache import invalidate_storefront
+
+    path = current_app.config['SITE_SETTINGS_STAMP_FILE']
+    _write_stamp(path)
+    with _cache_lock:
+        _cache.pop(path, None)
+    # 前台整页缓存里渲染了站点名称、二维码等设置，一并失效
+    invalidate_storefront()
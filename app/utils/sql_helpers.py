@@ -0,0 +1,11 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from app.extensions import db
+
+def dialect_insert():
+    """返回支持 ON CONFLICT 的 insert 构造函数；不支持的数据库返回 None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert
+    if dialect == 'postgresql':
+        return postgresql.insert
+    return None
@@ -0,0 +1,54 @@
+import time
+from urllib.parse import urlencode
+from flask import current_app, request
+from flask_wtf.csrf import generate_csrf
+from app.extensions import cache
+
+# 所有前台缓存键都带上这个版本号；商品增删改、上下架、成交后换一个新版本，旧键自然过期。
+# 版本号与缓存内容存放在同一个缓存后端，多 worker 部署时需使用共享后端（见 CACHE_TYPE）
+VERSION_KEY = 'storefront:version'
+# 整页缓存里用占位符替换 CSRF 令牌，命中时换成当前会话的令牌
+CSRF_PLACEHOLDER = '__STOREFRONT_CSRF_TOKEN__'
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # 版本键丢失（重启或被淘汰）时用时间戳，避免回到旧版本号读到过期内容
+        cache.add(VERSION_KEY, time.time_ns(), timeout=0)
+        version = cache.get(VERSION_KEY) or 0
+    return version
+
+def invalidate_storefront():
+    """商品变化后调用，使首页区块、标签列表和商品列表整页缓存全部失效"""
+    cache.set(VERSION_KEY, time.time_ns(), timeout=0)
+
+def args_key():
+    """按参数名排序后的查询串，作为缓存键的一部分"""
+    return urlencode(sorted(request.args.items(multi=True)))
+
+def _key(name, suffix=''):
+    return f"storefront:{_version()}:{name}:{suffix}"
+
+def cached_fragment(name, build, suffix='', timeout=None):
+    """读取缓存的片段（渲染好的HTML或数据），未命中时调用 build() 生成并写入"""
+    key = _key(name, suffix)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout=timeout or current_app.config['STOREFRONT_CACHE_TIMEOUT'])
+    return value
+
+def get_cached_page(name):
+    """读取整页缓存，返回填好 CSRF 令牌的HTML；未命中返回 None"""
+    html = cache.get(_key(name, args_key()))
+    if html is None:
+        return None
+    return html.replace(CSRF_PLACEHOLDER, generate_csrf())
+
+def set_cached_page(name, html, timeout=None):
+    """写入整页缓存（键包含查询参数），页面中的 CSRF 令牌替换为占位符"""
+    cache.set(
+        _key(name, args_key()),
+        html.replace(generate_csrf(), CSRF_PLACEHOLDER),
+        timeout=timeout or current_app.config['STOREFRONT_CACHE_TIMEOUT']
+    )
@@ -0,0 +1,53 @@
+import mimetypes
+import os
+import re
+from flask import current_app, request, send_from_directory, abort, Response
+from werkzeug.security import safe_join
+
+# 上传文件名由内容哈希（或 uuid）生成，同名文件内容永不改变，可以长期缓存
+IMMUTABLE_NAME = re.compile(
+    r'^([0-9a-f]{32}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(_[a-z0-9]+)?\.[a-z0-9]+$'
+)
+IMMUTABLE_MAX_AGE = 31536000
+
+def _cache_policy(filename):
+    """返回 (ETag, max_age, immutable)；内容寻址的文件名直接作为强 ETag"""
+    basename = os.path.basename(filename)
+    if IMMUTABLE_NAME.match(basename):
+        return basename, IMMUTABLE_MAX_AGE, True
+    return True, current_app.config.get('UPLOADS_MAX_AGE', 3600), False
+
+def send_upload(filename):
+    """
+    发送上传目录中的文件：带强 ETag / Last-Modified，支持 304 与 Range。
+    UPLOADS_SENDFILE='x-accel' 时只返回 X-Accel-Redirect 头，由 nginx 用 sendfile 发送文件内容；
+    'x-sendfile' 时由 Flask 的 USE_X_SENDFILE 输出 X-Sendfile 头（Apache/lighttpd）。
+    """
+    upload_folder = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    etag, max_age, immutable = _cache_policy(filename)
+    mode = current_app.config.get('UPLOADS_SENDFILE')
+
+    if mode == 'x-accel':
+        full_path = safe_join(upload_folder, filename)
+        if full_path is None or not os.path.isfile(full_path):
+            abort(404)
+        if etag is True:
+            stat = os.stat(full_path)
+            etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        response = Response(status=200)
+        response.set_etag(etag)
+        response.last_modified = int(os.path.getmtime(full_path))
+        response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        prefix = current_app.config.get('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + filename.lstrip('/')
+        response.make_conditional(request)
+        if response.status_code == 304:
+            del response.headers['X-Accel-Redirect']
+    else:
+        response = send_from_directory(upload_folder, filename, etag=etag, max_age=max_age, conditional=True)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,109 @@
+import atexit
+import os
+import threading
+from sqlalchemy import text
+from app.extensions import db
+
+class ViewCounter:
+    """
+    商品浏览量累加器：请求线程只在进程内存中计数，由后台线程定期把聚合后的增量
+    用一条批量 UPDATE 写回数据库，读请求不再占用写锁。
+    每 VIEW_COUNT_FLUSH_INTERVAL 秒或累计 VIEW_COUNT_FLUSH_HITS 次浏览写一次，
+    进程崩溃时最多丢失这一批计数；正常退出时会写回剩余计数。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}
+        self._hits = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('VIEW_COUNT_FLUSH_INTERVAL', 10)
+        self.flush_hits = app.config.get('VIEW_COUNT_FLUSH_HITS', 200)
+        app.extensions['view_counter'] = self
+        atexit.register(self._flush_at_exit)
+
+    def record(self, product_id):
+        """记录一次浏览"""
+        if self.flush_interval <= 0:
+            # 关闭缓冲时立即写回
+            self._write({product_id: 1})
+            return
+
+        self._ensure_flusher()
+        with self._lock:
+            self._pending[product_id] = self._pending.get(product_id, 0) + 1
+            self._hits += 1
+            full = self._hits >= self.flush_hits
+        if full:
+            self._wakeup.set()
+
+    def pending(self, product_id):
+        """本进程尚未写回的浏览次数，页面显示时加到 view_count 上"""
+        with self._lock:
+            return self._pending.get(product_id, 0)
+
+    def _ensure_flusher(self):
+        """按进程启动写回线程（fork 后的子进程不继承父进程的计数与线程）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pending = {}
+            self._hits = 0
+            thread = threading.Thread(target=self._flush_loop, name='view-counter', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending, self._hits = self._pending, {}, 0
+        return batch
+
+    def flush(self):
+        """把累计的浏览量写回数据库，返回写回的商品数"""
+        batch = self._take()
+        if not batch:
+            return 0
+        try:
+            self._write(batch)
+        except Exception as e:
+            # 写回失败时放回缓冲区，下一轮重试
+            print(f"写回浏览量失败: {e}")
+            with self._lock:
+                for product_id, count in batch.items():
+                    self._pending[product_id] = self._pending.get(product_id, 0) + count
+                self._hits += sum(batch.values())
+            return 0
+        return len(batch)
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                db.session.execute(
+                    text("UPDATE product SET view_count = COALESCE(view_count, 0) + :count WHERE id = :id"),
+                    [{'id': product_id, 'count': count} for product_id, count in sorted(batch.items())]
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _flush_at_exit(self):
+        if self.app is not None and self._pid == os.getpid():
+            self.flush()
+
+view_counter = ViewCounter()
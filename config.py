@@ -12,21 +12,85 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join('app', 'static', 'uploads')
     ORDER_STATE_DATA_DIR = os.environ.get('ORDER_STATE_DATA_DIR') or os.path.join('data', 'order_states')
+    ORDER_STATE_BACKEND = os.environ.get('ORDER_STATE_BACKEND') or 'eventlog'  # eventlog / json
+    ORDER_STATE_FSYNC = os.environ.get('ORDER_STATE_FSYNC') or 'batch'  # always / batch / never
+    ORDER_STATE_CACHE_SIZE = int(os.environ.get('ORDER_STATE_CACHE_SIZE') or 1024)  # 0 表示关闭读缓存
+    # 站点设置版本戳文件，多个 worker 需指向同一路径
+    SITE_SETTINGS_STAMP_FILE = os.environ.get('SITE_SETTINGS_STAMP_FILE') or os.path.join('data', 'site_settings.version')
+    GITHUB_API_URL = os.environ.get('GITHUB_API_URL') or 'https://api.github.com'
     NEZHA_URL = os.environ.get('NEZHA_URL')
     NEZHA_TOKEN = os.environ.get('NEZHA_TOKEN')
     
     # 图片上传配置
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    # 图片后台任务队列（缩略图、远程上传），IMAGE_JOB_WORKERS=0 时在请求内同步处理
+    IMAGE_JOB_DB = os.environ.get('IMAGE_JOB_DB') or os.path.join('data', 'image_jobs.db')
+    IMAGE_JOB_WORKERS = int(os.environ.get('IMAGE_JOB_WORKERS') or 2)
+    # 卡密文件导入：上传文件暂存目录、单个文件大小上限、每个事务写入的行数
+    CDKEY_IMPORT_DIR = os.environ.get('CDKEY_IMPORT_DIR') or os.path.join('data', 'cdkey_imports')
+    CDKEY_IMPORT_MAX_SIZE = int(os.environ.get('CDKEY_IMPORT_MAX_SIZE') or 256 * 1024 * 1024)
+    CDKEY_IMPORT_CHUNK_SIZE = int(os.environ.get('CDKEY_IMPORT_CHUNK_SIZE') or 5000)
+    CDKEY_IMPORT_STALE_SECONDS = int(os.environ.get('CDKEY_IMPORT_STALE_SECONDS') or 600)  # 心跳超时后由定时任务续跑
+    # 收款确认后自动发放卡密（默认关闭）。只有管理员标记已支付（或支付网关回调）才会触发，
+    # 用户自己点击“我已支付”不会发货。worker 线程数为 0 时在确认请求内同步发货
+    AUTO_FULFILLMENT = os.environ.get('AUTO_FULFILLMENT', '0') != '0'
+    FULFILLMENT_WORKERS = int(os.environ.get('FULFILLMENT_WORKERS') or 1)
+    FULFILLMENT_BATCH_SIZE = int(os.environ.get('FULFILLMENT_BATCH_SIZE') or 20)
+    FULFILLMENT_POLL_INTERVAL = int(os.environ.get('FULFILLMENT_POLL_INTERVAL') or 5)
+    # 各上传目录生成的尺寸变体（名称: 最大宽高），格式按优先级生成，JPEG 始终作为兜底
+    IMAGE_VARIANTS = {
+        'products': {'card': (480, 360), 'detail': (1200, 1200)},
+        'avatars': {'avatar': (160, 160)},
+    }
+    IMAGE_VARIANT_FORMATS = ('avif', 'webp')
+    # /uploads 交给前置服务器发送文件：x-accel（nginx，需配置 internal 的 UPLOADS_ACCEL_PREFIX）/ x-sendfile
+    UPLOADS_SENDFILE = os.environ.get('UPLOADS_SENDFILE')
+    UPLOADS_ACCEL_PREFIX = os.environ.get('UPLOADS_ACCEL_PREFIX') or '/protected-uploads/'
+    USE_X_SENDFILE = UPLOADS_SENDFILE == 'x-sendfile'
     
     # 分页配置
     POSTS_PER_PAGE = 20
+
+    # 前台缓存（首页区块、标签列表、游客商品列表页），后端可选 SimpleCache / FileSystemCache / RedisCache
+    # 前台缓存的失效版本号存放在缓存后端中，必须是多个 worker 共享的后端（FileSystemCache / RedisCache）；
+    # SimpleCache 只在单进程内有效，多 worker 部署下失效无法传到其他进程
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'FileSystemCache'
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join('data', 'cache')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_DEFAULT_TIMEOUT = 300
+    STOREFRONT_CACHE_TIMEOUT = int(os.environ.get('STOREFRONT_CACHE_TIMEOUT') or 300)
+
+    # 后台统计快照缓存时间（秒）
+    DASHBOARD_STATS_TTL = 60
+
+    # 关键词搜索只对最新的 N 条匹配计算 bm25 并排序，宽泛关键词不必给全部命中打分
+    SEARCH_CANDIDATE_LIMIT = int(os.environ.get('SEARCH_CANDIDATE_LIMIT') or 500)
+
+    # 商品浏览量在进程内累计后批量写回：每隔 N 秒或累计 N 次浏览写一次，间隔为 0 时每次浏览立即写回
+    VIEW_COUNT_FLUSH_INTERVAL = int(os.environ.get('VIEW_COUNT_FLUSH_INTERVAL') or 10)
+    VIEW_COUNT_FLUSH_HITS = int(os.environ.get('VIEW_COUNT_FLUSH_HITS') or 200)
     
     # 邀请系统配置
     AFF_COMMISSION_RATE = 0.1  # 10% 佣金比例
     MIN_WITHDRAWAL_AMOUNT = 10  # 最低提现金额
     SETTLEMENT_PERIOD = 7  # 结算周期（天）
 
+    # 应用内定时任务：各 worker 进程通过数据库租约抢占，同一任务每次只有一个进程执行
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '1') != '0'
+    SCHEDULER_TICK = 30  # 检查到期任务的间隔（秒）
+    SCHEDULER_LEASE_SECONDS = 900  # 单次执行的租约时长，超时未释放视为进程崩溃
+    # 执行计划：整数为间隔秒数，字符串为 cron 表达式（分 时 日 月 周，服务器本地时间），None 停用
+    SCHEDULED_JOBS = {
+        'settle_earnings': '30 3 * * *',
+        'expire_unpaid_orders': 300,
+        'recount_cdkey_stock': '15 4 * * *',
+        'purge_finished_jobs': '45 4 * * *',
+        'resume_cdkey_imports': 60,
+    }
+    ORDER_PAYMENT_TIMEOUT_MINUTES = int(os.environ.get('ORDER_PAYMENT_TIMEOUT_MINUTES') or 30)
+    FINISHED_JOB_RETENTION_DAYS = 30
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
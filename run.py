@@ -1,6 +1,7 @@
 from app import create_app
 from app.extensions import db, bcrypt
 from app.models import User
+from app.utils.order_rollup import record_user_created
 import os
 import secrets
 
@@ -28,6 +29,7 @@ def init_admin():
                 total_earned=0.0
             )
             db.session.add(admin)
+            record_user_created(admin)
             db.session.commit()
             print(f'超级管理员已创建: admin / admin123 (请立即修改初始密码!)')
             print(f'管理员邀请码: {invite_code}')
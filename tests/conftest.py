@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+import pytest
+
+# 配置在导入时读取环境变量，须在导入 app 之前指向临时目录
+_TMP = tempfile.mkdtemp(prefix='shop-tests-')
+for _name, _value in {
+    'DATABASE_URL': f"sqlite:///{os.path.join(_TMP, 'test.db')}",
+    'ORDER_STATE_DATA_DIR': os.path.join(_TMP, 'order_states'),
+    'UPLOAD_FOLDER': os.path.join(_TMP, 'uploads'),
+    'SITE_SETTINGS_STAMP_FILE': os.path.join(_TMP, 'site_settings.version'),
+    'IMAGE_JOB_DB': os.path.join(_TMP, 'image_jobs.db'),
+    'CDKEY_IMPORT_DIR': os.path.join(_TMP, 'cdkey_imports'),
+    'CACHE_DIR': os.path.join(_TMP, 'cache'),
+    'SCHEDULER_ENABLED': '0',
+}.items():
+    os.environ[_name] = _value
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return app
+
+
+@pytest.fixture
+def db(app):
+    from app.extensions import db
+
+    with app.app_context():
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def make_user(app):
+    """建一个用户并返回已登录的测试客户端；不要与 db 夹具同时使用，否则各请求共用同一个 g，登录状态会串"""
+    import uuid
+    from app.extensions import bcrypt, db
+    from app.models import User
+
+    def make(role='user'):
+        name = f'{role}-{uuid.uuid4().hex[:8]}'
+        with app.app_context():
+            user = User(
+                username=name, display_name=name, email=f'{name}@example.com', role=role,
+                invite_code=uuid.uuid4().hex[:10], password_hash=bcrypt.generate_password_hash('pw', 4).decode()
+            )
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            db.session.remove()
+        client = app.test_client()
+        client.user_id = user_id
+        response = client.post('/auth/login', data={'username': name, 'password': 'pw'})
+        assert response.status_code == 302
+        return client
+
+    return make
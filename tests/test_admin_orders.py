@@ -0,0 +1,122 @@
+import uuid
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.models import CDKey, FulfillmentJob, Order_Core, OrderItem, Product
+from app.utils.fulfillment import fulfillment
+
+
+def _claimed_paid_order(app, user_id):
+    """用户自己声明已支付、尚未确认收款的卡密订单"""
+    with app.app_context():
+        product = Product(name='confirm payment', price=5, description='desc', cdkey_stock=1, stock_virtual=1)
+        db.session.add(product)
+        db.session.flush()
+        db.session.add(CDKey(product_id=product.id, key='KEY-CONFIRM'))
+        order = Order_Core(user_id=user_id, order_no=uuid.uuid4().hex[:6], original_amount=5, final_amount=5,
+                           cached_status='user_paid')
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price=5))
+        db.session.commit()
+        fulfillment.state_manager.create_initial_state(order.id, user_id, [], order_no=order.order_no)
+        return order.id
+
+
+def test_confirm_payment_enqueues_fulfillment(app, make_user, monkeypatch):
+    admin = make_user('admin')
+    order_id = _claimed_paid_order(app, admin.user_id)
+    monkeypatch.setattr(fulfillment, 'enabled', True)
+    monkeypatch.setattr(fulfillment, 'workers', 0)
+    notified = []
+    monkeypatch.setattr(fulfillment, 'notify', lambda: notified.append(1))
+
+    assert '确认收款' in admin.get(f'/admin/orders/{order_id}').get_data(as_text=True)
+    assert 'confirmPayment(' in admin.get('/admin/orders?status=user_paid').get_data(as_text=True)
+
+    response = admin.post(f'/admin/orders/{order_id}/confirm_payment', json={})
+    assert response.get_json()['success']
+
+    # 确认与发货任务在同一次提交中写入
+    with app.app_context():
+        order = db.session.get(Order_Core, order_id)
+        job = FulfillmentJob.query.filter_by(order_id=order_id).one()
+        assert order.payment_confirmed_at is not None
+        assert (order.cached_status, job.status) == ('user_paid', 'pending')
+    assert notified == [1]
+
+    # 重复确认被拒绝，不会再登记任务
+    response = admin.post(f'/admin/orders/{order_id}/confirm_payment', json={})
+    assert not response.get_json()['success']
+
+    fulfillment.run_pending()
+    with app.app_context():
+        assert db.session.get(Order_Core, order_id).cached_status == 'shipped'
+        assert CDKey.query.filter_by(order_id=order_id).one().key == 'KEY-CONFIRM'
+    assert fulfillment.state_manager.get_order_state(order_id)['assigned_cdkey'] == ['KEY-CONFIRM']
+
+
+def test_confirm_payment_requires_a_claimed_payment(app, make_user):
+    admin = make_user('admin')
+    order_id = _claimed_paid_order(app, admin.user_id)
+    with app.app_context():
+        Order_Core.query.filter_by(id=order_id).update({Order_Core.cached_status: 'pending_payment'})
+        db.session.commit()
+
+    response = admin.post(f'/admin/orders/{order_id}/confirm_payment', json={})
+    assert not response.get_json()['success']
+    with app.app_context():
+        assert db.session.get(Order_Core, order_id).payment_confirmed_at is None
+        assert FulfillmentJob.query.filter_by(order_id=order_id).count() == 0
+
+
+@contextmanager
+def competing_update(order_id, status):
+    """路由执行条件更新之前，另一个连接抢先把订单改为 status 并提交"""
+    def before_update(orm_execute_state):
+        if orm_execute_state.is_update and not fired:
+            fired.append(1)
+            with db.engine.begin() as connection:
+                connection.execute(text("UPDATE order_core SET cached_status = :status WHERE id = :id"),
+                                   {'status': status, 'id': order_id})
+
+    fired = []
+    event.listen(Session, 'do_orm_execute', before_update)
+    try:
+        yield fired
+    finally:
+        event.remove(Session, 'do_orm_execute', before_update)
+
+
+@pytest.mark.parametrize('action, competing_status', [
+    ('confirm_receipt', 'completed'),
+    ('complete_order', 'rejected'),
+    ('reject_order', 'completed'),
+])
+def test_status_transitions_lose_the_race_cleanly(app, make_user, action, competing_status):
+    client = make_user('admin')
+    order_id = _claimed_paid_order(app, client.user_id)
+    with app.app_context():
+        Order_Core.query.filter_by(id=order_id).update({Order_Core.cached_status: 'shipped'})
+        db.session.commit()
+    events_before = len(fulfillment.state_manager.get_order_state(order_id).get('history', []))
+
+    urls = {
+        'confirm_receipt': f'/order/confirm/{order_id}',
+        'complete_order': f'/admin/orders/{order_id}/complete',
+        'reject_order': f'/admin/orders/{order_id}/reject',
+    }
+    with competing_update(order_id, competing_status) as fired:
+        response = client.post(urls[action], data={'reason': 'race'})
+    assert fired
+    if action == 'confirm_receipt':
+        assert not response.get_json()['success']
+    else:
+        assert response.status_code == 302
+
+    with app.app_context():
+        assert db.session.get(Order_Core, order_id).cached_status == competing_status
+    # 输掉竞争的一方不写订单状态
+    assert len(fulfillment.state_manager.get_order_state(order_id).get('history', [])) == events_before
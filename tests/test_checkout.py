@@ -0,0 +1,39 @@
+import threading
+import uuid
+from app.extensions import db
+from app.models import Cart, DiscountCode, Order_Core, OrderItem, Product
+
+
+def test_concurrent_checkouts_respect_discount_max_uses(app, make_user):
+    buyers = [make_user() for _ in range(12)]
+    code = uuid.uuid4().hex[:12]
+    with app.app_context():
+        product = Product(name='checkout race', price=10, description='desc', stock_virtual=1000)
+        discount = DiscountCode(code=code, type='fixed', value=1, max_uses=3)
+        db.session.add_all([product, discount])
+        db.session.flush()
+        db.session.add_all([Cart(user_id=buyer.user_id, product_id=product.id, quantity=2) for buyer in buyers])
+        db.session.commit()
+        product_id, discount_id = product.id, discount.id
+
+    barrier = threading.Barrier(len(buyers))
+    results = []
+
+    def checkout(client):
+        barrier.wait()
+        response = client.post('/order/create', json={'discount_code': code, 'payment_method': 'alipay'})
+        results.append(response.get_json())
+
+    threads = [threading.Thread(target=checkout, args=(buyer,)) for buyer in buyers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        orders = Order_Core.query.filter_by(discount_code_id=discount_id).count()
+        ordered = db.session.query(db.func.sum(OrderItem.quantity)).filter_by(product_id=product_id).scalar()
+        assert len(results) == len(buyers)
+        assert sum(1 for result in results if result['success']) == orders == 3
+        assert db.session.get(DiscountCode, discount_id).used_count == 3
+        assert db.session.get(Product, product_id).sold_count == ordered == 6
@@ -0,0 +1,18 @@
+from app.extensions import cache
+from app.utils import dashboard_stats
+from app.utils.dashboard_stats import get_dashboard_stats, invalidate_dashboard_stats
+
+
+def test_snapshot_is_shared_through_the_cache_backend(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(dashboard_stats, 'compute_dashboard_stats', lambda: calls.append(1) or {'n': len(calls)})
+    invalidate_dashboard_stats()
+
+    assert get_dashboard_stats(60) == {'n': 1}
+    assert get_dashboard_stats(60) == {'n': 1}
+
+    # 另一个 worker 失效时只改共享缓存中的版本号，本进程下一次读取即重新计算
+    cache.set(dashboard_stats.VERSION_KEY, 'bumped-elsewhere', timeout=0)
+    assert get_dashboard_stats(60) == {'n': 2}
+    invalidate_dashboard_stats()
+    assert get_dashboard_stats(60) == {'n': 3}
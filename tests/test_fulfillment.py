@@ -0,0 +1,72 @@
+import uuid
+from datetime import datetime
+from sqlalchemy import text
+from app.models import CDKey, FulfillmentJob, Order_Core, OrderItem, Product, User
+from app.utils.fulfillment import fulfillment
+
+
+def _paid_order(db, keys=('KEY-1',)):
+    name = uuid.uuid4().hex[:8]
+    user = User(username=name, display_name=name, email=f'{name}@example.com', invite_code=name, password_hash='x')
+    product = Product(name='fulfillment', price=5, description='desc', cdkey_stock=len(keys), stock_virtual=len(keys))
+    db.session.add_all([user, product])
+    db.session.flush()
+    db.session.add_all([CDKey(product_id=product.id, key=key) for key in keys])
+    order = Order_Core(user_id=user.id, order_no=uuid.uuid4().hex[:6], original_amount=5, final_amount=5,
+                       cached_status='user_paid')
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=len(keys), price=5))
+    now = datetime.utcnow()
+    job = FulfillmentJob(order_id=order.id, status='pending', attempts=0, run_after=now, created_at=now, updated_at=now)
+    db.session.add(job)
+    db.session.commit()
+    fulfillment.state_manager.create_initial_state(order.id, user.id, [], order_no=order.order_no)
+    return order.id, job.id
+
+
+def test_order_state_is_written_after_the_shipment_commits(db, monkeypatch):
+    order_id, job_id = _paid_order(db)
+    seen = []
+    assign_cdkey = fulfillment.state_manager.assign_cdkey
+
+    def record_committed_state(order, cdkeys):
+        # 另开连接读取，只能看到已提交的数据
+        with db.engine.connect() as connection:
+            seen.append((
+                connection.execute(text("SELECT cached_status FROM order_core WHERE id = :id"), {'id': order}).scalar(),
+                connection.execute(text("SELECT status FROM fulfillment_job WHERE id = :id"), {'id': job_id}).scalar(),
+            ))
+        return assign_cdkey(order, cdkeys)
+
+    monkeypatch.setattr(fulfillment.state_manager, 'assign_cdkey', record_committed_state)
+    fulfillment.run_pending()
+
+    assert seen == [('shipped', 'done')]
+    state = fulfillment.state_manager.get_order_state(order_id)
+    assert state['status'] == 'shipped'
+    assert state['assigned_cdkey'] == ['KEY-1']
+
+
+def test_failed_commit_leaves_no_order_state(db, monkeypatch):
+    order_id, job_id = _paid_order(db)
+    commit = db.session.commit
+    calls = []
+
+    def fail_shipment_commit():
+        calls.append(1)
+        # 第一次是领取任务，第二次是发货提交
+        if len(calls) == 2:
+            raise RuntimeError('database is locked')
+        return commit()
+
+    monkeypatch.setattr(db.session, 'commit', fail_shipment_commit)
+    fulfillment.run_pending()
+    monkeypatch.undo()
+
+    db.session.expire_all()
+    job = db.session.get(FulfillmentJob, job_id)
+    assert (job.status, job.last_error) == ('pending', 'database is locked')
+    assert db.session.get(Order_Core, order_id).cached_status == 'user_paid'
+    assert not fulfillment.state_manager.get_order_state(order_id).get('assigned_cdkey')
+    assert CDKey.query.filter_by(order_id=order_id).count() == 0
@@ -0,0 +1,125 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography.fernet import InvalidToken
+from urllib3.exceptions import NewConnectionError, ReadTimeoutError
+
+from app.utils import image_processor
+from app.utils.crypto import decrypt_text, encrypt_text
+from app.utils.image_processor import ImageProcessor, get_github_session
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    """GitHub contents API 桩：按 responses 队列返回 PUT 结果，记录每个请求的客户端端口"""
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.server.calls.append(('GET', path, self.client_address[1]))
+        if path in self.server.files:
+            self._send(200, {'download_url': f'https://cdn{path}'})
+        else:
+            self._send(404, {})
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        path = self.path.split('?')[0]
+        self.server.calls.append(('PUT', path, self.client_address[1]))
+        code = self.server.responses.pop(0) if self.server.responses else 201
+        if code == 429:
+            return self._send(429, {}, {'Retry-After': '0'})
+        if code == 201:
+            self.server.files.add(path)
+            return self._send(201, {'content': {'download_url': f'https://cdn{path}'}})
+        self._send(code, {})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def github(app, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubGitHub)
+    server.calls, server.files, server.responses = [], set(), []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(app.config, 'GITHUB_API_URL', f'http://127.0.0.1:{server.server_port}')
+    # 每个测试使用新的会话与连接池
+    monkeypatch.setattr(image_processor, '_github_session', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def upload(app, content):
+    with app.app_context():
+        processor = ImageProcessor(app.config['UPLOAD_FOLDER'])
+        return processor._upload_to_github(content, 'png', 'products', 'owner/repo', 'main', 'token')
+
+
+def test_connections_are_reused(app, github):
+    for i in range(3):
+        assert upload(app, f'image-{i}'.encode()).startswith('https://cdn/')
+    assert [method for method, _, _ in github.calls] == ['GET', 'PUT'] * 3
+    assert len({port for _, _, port in github.calls}) == 1
+
+
+def test_429_is_retried(app, github):
+    github.responses = [429]
+    assert upload(app, b'rate-limited')
+    assert [method for method, _, _ in github.calls] == ['GET', 'PUT', 'PUT']
+
+
+def test_5xx_on_put_is_not_retried(app, github):
+    github.responses = [503]
+    with pytest.raises(RuntimeError):
+        upload(app, b'server-error')
+    # 一次 PUT，随后只查询文件是否已存在
+    assert [method for method, _, _ in github.calls] == ['GET', 'PUT', 'GET']
+
+
+def test_lost_create_is_treated_as_success(app, github):
+    # 创建已生效但返回了 502
+    github.responses = [502]
+    original = StubGitHub.do_PUT
+
+    def create_then_fail(handler):
+        path = handler.path.split('?')[0]
+        handler.server.files.add(path)
+        original(handler)
+
+    StubGitHub.do_PUT = create_then_fail
+    try:
+        assert upload(app, b'lost-response').startswith('https://cdn/')
+    finally:
+        StubGitHub.do_PUT = original
+    assert [method for method, _, _ in github.calls].count('PUT') == 1
+
+
+def test_connect_errors_are_retried_but_read_errors_are_not():
+    retry = get_github_session().get_adapter('https://api.github.com').max_retries
+    retry = retry.increment('PUT', '/x', error=NewConnectionError(None, 'refused'))
+    assert retry.connect == 2
+    with pytest.raises(Exception):
+        retry.increment('PUT', '/x', error=ReadTimeoutError(None, '/x', 'timed out'))
+
+
+def test_decrypt_is_memoized_per_secret_and_ciphertext():
+    decrypt_text.cache_clear()
+    cipher = encrypt_text('token', 'key-a')
+    assert decrypt_text(cipher, 'key-a') == 'token'
+    assert decrypt_text(cipher, 'key-a') == 'token'
+    assert decrypt_text.cache_info().hits == 1
+    # 换了 SECRET_KEY 不会命中旧结果
+    with pytest.raises(InvalidToken):
+        decrypt_text(cipher, 'key-b')
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+
+from app.utils.order_state_manager import OrderStateManager
+
+
+def _write_legacy_order(data_dir, order_id):
+    state = {
+        "order_id": order_id,
+        "user_id": 1,
+        "status": "pending_payment",
+        "items": [],
+        "history": [{"status": "pending_payment", "timestamp": "2024-01-01T00:00:00", "message": "订单创建"}],
+        "assigned_cdkey": None
+    }
+    with open(os.path.join(data_dir, f"order_{order_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+
+
+def _read_log(manager):
+    backend = manager.backend
+    with open(backend.segment_path(backend._current_segment()), 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_legacy_order_first_update_is_not_replayed_twice(tmp_path):
+    _write_legacy_order(str(tmp_path), 7)
+    manager = OrderStateManager(str(tmp_path), cache_size=0, fsync='never')
+
+    manager.update_state(7, 'user_paid', '用户已支付')
+
+    snapshot, event = _read_log(manager)
+    assert snapshot['type'] == 'snapshot'
+    assert [entry['status'] for entry in snapshot['state']['history']] == ['pending_payment']
+    assert event['type'] == 'status'
+
+    state = manager.get_order_state(7)
+    assert state['status'] == 'user_paid'
+    assert [entry['status'] for entry in state['history']] == ['pending_payment', 'user_paid']
+
+
+def test_snapshot_and_update_in_one_batch(tmp_path):
+    manager = OrderStateManager(str(tmp_path), cache_size=0, fsync='never')
+
+    with manager.batch():
+        manager.create_initial_state(8, 1, [])
+        manager.update_state(8, 'user_paid', '用户已支付')
+
+    snapshot = _read_log(manager)[0]
+    assert [entry['status'] for entry in snapshot['state']['history']] == ['pending_payment']
+    assert [entry['status'] for entry in manager.get_order_state(8)['history']] == ['pending_payment', 'user_paid']
+
+
+def test_migration_snapshot_does_not_overwrite_live_events(tmp_path):
+    _write_legacy_order(str(tmp_path), 9)
+    manager = OrderStateManager(str(tmp_path), cache_size=0, fsync='never')
+    backend = manager.backend
+
+    with backend.batch():
+        # 迁移读取旧 JSON 并缓存快照，批次提交前订单被在线更新
+        with open(backend.legacy.get_order_state_file(9), 'r', encoding='utf-8') as f:
+            backend.append(9, {"type": "snapshot", "state": json.load(f)})
+        thread = threading.Thread(target=manager.update_state, args=(9, 'user_paid', '用户已支付'))
+        thread.start()
+        thread.join()
+
+    state = manager.get_order_state(9)
+    assert state['status'] == 'user_paid'
+    assert [entry['status'] for entry in state['history']] == ['pending_payment', 'user_paid']
+
+
+def test_index_connection_is_reused_per_thread(tmp_path, monkeypatch):
+    manager = OrderStateManager(str(tmp_path), fsync='never')
+    manager.create_initial_state(10, 1, [])
+    manager.get_order_state(10)
+
+    connects = []
+    original = manager.backend._connect
+    monkeypatch.setattr(manager.backend, '_connect', lambda: connects.append(1) or original())
+    for _ in range(20):
+        assert manager.get_order_state(10)['status'] == 'pending_payment'
+    manager.update_state(10, 'user_paid')
+    assert manager.get_order_state(10)['status'] == 'user_paid'
+    assert connects == []
+
+    # 其他线程写入后，本线程的长连接能读到新版本
+    thread = threading.Thread(target=manager.update_state, args=(10, 'shipped'))
+    thread.start()
+    thread.join()
+    assert manager.get_order_state(10)['status'] == 'shipped'
+    assert manager.cache_info()['hits'] >= 20
@@ -0,0 +1,37 @@
+import uuid
+from sqlalchemy import text
+from app.models import Product
+from app.utils.search_index import apply_search, ensure_search_indexes
+
+
+def _add_products(db, word, count):
+    products = [Product(name=f'{word} {i}', price=1, description='desc') for i in range(count)]
+    db.session.add_all(products)
+    db.session.commit()
+    return [product.id for product in products]
+
+
+def test_search_ranks_only_newest_candidates(app, db, monkeypatch):
+    word = f'cap{uuid.uuid4().hex[:8]}'
+    ids = _add_products(db, word, 5)
+    monkeypatch.setitem(app.config, 'SEARCH_CANDIDATE_LIMIT', 3)
+
+    query, rank = apply_search(Product.query, Product, word)
+    assert rank is not None
+    assert sorted(product.id for product in query.all()) == ids[-3:]
+
+
+def test_outdated_fts_table_is_rebuilt_with_prefix_index(db):
+    word = f'old{uuid.uuid4().hex[:8]}'
+    ids = _add_products(db, word, 2)
+    db.session.execute(text("DROP TABLE product_fts"))
+    db.session.execute(text(
+        "CREATE VIRTUAL TABLE product_fts USING fts5(name, description, category, tags, tokenize='unicode61')"
+    ))
+    db.session.commit()
+
+    ensure_search_indexes()
+    create_sql = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'product_fts'")).scalar()
+    assert "prefix='2 3 4'" in create_sql
+    query, _ = apply_search(Product.query, Product, word[:6])
+    assert sorted(product.id for product in query.all()) == ids
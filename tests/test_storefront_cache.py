@@ -0,0 +1,19 @@
+import uuid
+
+
+def test_saving_settings_invalidates_guest_pages(app, make_user):
+    guest = app.test_client()
+    admin = make_user('admin')
+
+    def save_site_name(name):
+        response = admin.post('/admin/settings/update', data={'site_name': name, 'settlement_period': '7'})
+        assert response.status_code == 302
+
+    old_name, new_name = f'old-{uuid.uuid4().hex[:6]}', f'new-{uuid.uuid4().hex[:6]}'
+    save_site_name(old_name)
+    assert old_name in guest.get('/product/list').get_data(as_text=True)
+
+    save_site_name(new_name)
+    page = guest.get('/product/list').get_data(as_text=True)
+    assert new_name in page
+    assert old_name not in page